@@ -13,7 +13,10 @@ def load_requirements():
 extras_require = {
     "test": [
         "pytest",
-    ]
+    ],
+    "fast": [
+        "orjson >= 3.9.0",
+    ],
 }
 
 if __name__ == "__main__":
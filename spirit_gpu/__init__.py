@@ -1,16 +1,18 @@
-import asyncio
+from . import startup
+
 import os
 from typing import Dict, Any, Optional
 
 
 from .conf import Config, load_config
 from .env import Env
-from .worker import run
 from .log import logger
-from . import utils, server
+from . import utils
 
 __all__ = ["start", "utils", "logger"]
 
+startup.mark("import")
+
 
 def start(handlers: Dict[str, Any], custom_wd: Optional[str] = None):
     """
@@ -23,11 +25,20 @@ def start(handlers: Dict[str, Any], custom_wd: Optional[str] = None):
         config = load_config(config_file)
     else:
         config = Config()
+    startup.mark("config")
     env = Env(config)
+    startup.mark("env")
 
+    # worker and test server need aiohttp and more, only import the one which runs
     if utils.is_test_mode():
+        from . import server
+
         server.run(handlers, env)
         return
 
+    import asyncio
+    from .worker import run
+
+    startup.mark("import worker")
     logger.info(f"start worker")
     asyncio.run(run(handlers, env))
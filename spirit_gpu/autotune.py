@@ -0,0 +1,174 @@
+"""
+Concurrency modifier adjusting allowed concurrency by observed execution time, throughput and errors.
+
+    start({"handler": handler, "concurrency_modifier": AdaptiveConcurrency(min_concurrency=1, max_concurrency=16)})
+"""
+
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+from . import metrics
+from .log import logger
+
+INCREASE = "increase"
+DECREASE = "decrease"
+HOLD = "hold"
+
+AUTOTUNE_LIMIT = metrics.gauge("spirit_autotune_concurrency", "Allowed concurrency chosen by adaptive concurrency.")
+AUTOTUNE_DECISIONS = metrics.counter(
+    "spirit_autotune_decisions_total", "Decisions of adaptive concurrency at the end of each window.", ["decision", "reason"]
+)
+AUTOTUNE_LATENCY = metrics.gauge(
+    "spirit_autotune_latency_seconds", "Mean execution time of the last window and of the baseline.", ["kind"]
+)
+
+
+class AdaptiveConcurrency:
+    """
+    Additive increase, multiplicative decrease of allowed concurrency, decided once per window.
+
+    The worker reports execution time and error of every request by observe(). At the end of a window,
+    allowed concurrency is
+        decreased by decrease_factor if error rate exceeds error_rate, or mean execution time exceeds
+            latency_tolerance times the baseline, i.e. the one measured with min_concurrency or the lowest so far;
+        decreased by step if the last increase did not raise throughput by min_gain;
+        increased by step if requests kept allowed concurrency busy, estimated as throughput * mean execution time;
+        kept otherwise, e.g. there are not enough tasks to use more.
+    """
+
+    def __init__(
+        self,
+        min_concurrency: int = 1,
+        max_concurrency: int = 8,
+        initial: Optional[int] = None,
+        window: float = 5.0,
+        min_samples: int = 5,
+        step: int = 1,
+        decrease_factor: float = 0.7,
+        latency_tolerance: float = 1.5,
+        error_rate: float = 0.1,
+        utilization: float = 0.8,
+        min_gain: float = 0.05,
+    ):
+        """
+        window: min seconds between two decisions.
+        min_samples: min number of finished requests to decide, the window is extended until there are enough.
+        utilization: ratio of allowed concurrency which needs to be busy to increase it.
+        min_gain: min ratio of throughput growth to keep an increase.
+        """
+        if min_concurrency < 1 or max_concurrency < min_concurrency:
+            raise ValueError(f"invalid concurrency bounds [{min_concurrency}, {max_concurrency}]")
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.window = window
+        self.min_samples = max(1, min_samples)
+        self.step = max(1, step)
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.error_rate = error_rate
+        self.utilization = utilization
+        self.min_gain = min_gain
+
+        self.limit = self._bound(initial if initial is not None else min_concurrency)
+        self.baseline: Optional[float] = None
+        # last 100 decisions, for inspection
+        self.history: List[Dict[str, Any]] = []
+
+        self._window_start = time.monotonic()
+        # execution time of successful requests, failed ones may fail fast and do not tell the load
+        self._seconds: List[float] = []
+        self._errors = 0
+        # throughput of the window before the last increase, None if last decision is not an increase
+        self._throughput_before: Optional[float] = None
+        AUTOTUNE_LIMIT.set(self.limit)
+
+    def _bound(self, limit: int) -> int:
+        return max(self.min_concurrency, min(self.max_concurrency, limit))
+
+    def observe(self, seconds: float, error: bool = False):
+        """
+        Called by worker when handler of a request finishes.
+        """
+        if error:
+            self._errors += 1
+        else:
+            self._seconds.append(seconds)
+
+    def __call__(self, current: int) -> int:
+        now = time.monotonic()
+        if now - self._window_start >= self.window and len(self._seconds) + self._errors >= self.min_samples:
+            self._decide(now)
+        return self.limit
+
+    def _decide(self, now: float):
+        elapsed = now - self._window_start
+        count = len(self._seconds) + self._errors
+        error_rate = self._errors / count
+        mean = sum(self._seconds) / len(self._seconds) if len(self._seconds) > 0 else 0.0
+        # successful requests per second
+        throughput = len(self._seconds) / elapsed
+        # average number of running requests, by Little's law
+        busy = throughput * mean
+
+        if len(self._seconds) > 0:
+            if self.baseline is None or self.limit == self.min_concurrency:
+                # least contention at min concurrency, what it measures is the baseline, even if handler became slower
+                self.baseline = mean
+            else:
+                self.baseline = min(self.baseline, mean)
+
+        limit = self.limit
+        # 0 before any request succeeds
+        baseline = self.baseline if self.baseline is not None else 0.0
+        if error_rate > self.error_rate:
+            decision, reason = DECREASE, "errors"
+        elif len(self._seconds) > 0 and mean > baseline * self.latency_tolerance:
+            decision, reason = DECREASE, "latency"
+        elif self._throughput_before is not None and throughput < self._throughput_before * (1 + self.min_gain):
+            decision, reason = DECREASE, "no gain"
+        elif busy >= self.limit * self.utilization:
+            decision, reason = INCREASE, "busy"
+        else:
+            decision, reason = HOLD, "idle"
+
+        if reason == "no gain":
+            limit = self._bound(self.limit - self.step)
+        elif decision == DECREASE:
+            limit = self._bound(min(self.limit - 1, math.floor(self.limit * self.decrease_factor)))
+        elif decision == INCREASE:
+            limit = self._bound(self.limit + self.step)
+        if limit == self.limit:
+            decision = HOLD
+
+        AUTOTUNE_DECISIONS.labels(decision, reason).inc()
+        AUTOTUNE_LATENCY.labels("window").set(mean)
+        AUTOTUNE_LATENCY.labels("baseline").set(baseline)
+        self.history.append(
+            {
+                "limit": self.limit,
+                "newLimit": limit,
+                "decision": decision,
+                "reason": reason,
+                "samples": count,
+                "meanSeconds": mean,
+                "baselineSeconds": baseline,
+                "errorRate": error_rate,
+                "throughput": throughput,
+                "busy": busy,
+            }
+        )
+        del self.history[:-100]
+        if limit != self.limit:
+            logger.info(
+                f"adaptive concurrency {decision} from {self.limit} to {limit} by {reason}, mean execution time: "
+                f"{round(mean * 1000)}ms, baseline: {round(baseline * 1000)}ms, error rate: {round(error_rate, 3)}, "
+                f"throughput: {round(throughput, 3)}/s"
+            )
+        self._throughput_before = throughput if limit > self.limit else None
+        self.limit = limit
+        AUTOTUNE_LIMIT.set(limit)
+
+        self._window_start = now
+        self._seconds = []
+        self._errors = 0
@@ -0,0 +1,149 @@
+import asyncio
+import inspect
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from .env import Env
+from .executor import ExecutorType, get_executor_type
+from .log import logger
+from .utils import current_unix_milli
+
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_WAIT_MS = 10
+
+
+@dataclass
+class _Item:
+    request: Any
+    # unix milliseconds, None means no deadline
+    deadline: Optional[int]
+    arrive_at: int
+    future: "asyncio.Future[Any]"
+
+
+class BatchScheduler:
+    """
+    Group requests and call batch handler once per group.
+
+    A batch is sent when it has max_batch_size requests, when its first request waited max_wait_ms,
+    or when the earliest deadline of its requests is reached, whichever comes first.
+    Batches run one after another, requests arriving during a batch are collected for the next one.
+    """
+
+    def __init__(self, handler: Any, env: Env, max_batch_size: int, max_wait_ms: int, executor: Optional[Executor]):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._handler = handler
+        self._env = env
+        self._executor = executor
+        self._pending: List[_Item] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, request: Any, deadline: Optional[int] = None) -> Any:
+        """
+        Queue a request and wait for its result.
+        deadline: unix milliseconds, the batch containing this request is sent no later than it.
+        """
+        if self._task is None:
+            self.start()
+        assert self._wakeup is not None
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Item(request, deadline, current_unix_milli(), future))
+        self._wakeup.set()
+        return await future
+
+    def _send_at(self) -> int:
+        send_at = self._pending[0].arrive_at + self.max_wait_ms
+        for item in self._pending:
+            if item.deadline is not None:
+                send_at = min(send_at, item.deadline)
+        return send_at
+
+    async def _run(self):
+        assert self._wakeup is not None
+        while True:
+            if len(self._pending) == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            while len(self._pending) < self.max_batch_size:
+                wait = self._send_at() - current_unix_milli()
+                if wait <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait / 1000)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._pending[: self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size :]
+            await self._execute(batch)
+
+    async def _call(self, requests: List[Any]) -> Any:
+        if inspect.iscoroutinefunction(self._handler):
+            return await self._handler(requests, self._env)
+        if self._executor is None:
+            return self._handler(requests, self._env)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._handler, requests, self._env)
+
+    async def _execute(self, batch: List[_Item]):
+        # requests cancelled while waiting, e.g. their task is gone, are not sent to handler
+        batch = [item for item in batch if not item.future.done()]
+        if len(batch) == 0:
+            return
+
+        logger.debug(f"call batch handler with {len(batch)} requests")
+        try:
+            results = await self._call([item.request for item in batch])
+            results = list(results)
+            if len(results) != len(batch):
+                raise Exception(f"batch handler returns {len(results)} results for {len(batch)} requests")
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+
+        for item, result in zip(batch, results):
+            if not item.future.done():
+                item.future.set_result(result)
+
+
+def _get_positive_int(handlers: Dict[str, Any], key: str, default: int) -> int:
+    value = handlers.get(key, default)
+    try:
+        v = int(value)
+        if v < 1:
+            raise ValueError(f"{key} should be at least 1")
+    except Exception as e:
+        logger.error(f"invalid {key} {value}, use default {default}, err: {e}")
+        v = default
+    return v
+
+
+def new_batch_scheduler(handlers: Dict[str, Any], env: Env, executor: Optional[Executor]) -> Optional[BatchScheduler]:
+    """
+    Create scheduler for handlers["batch_handler"], None if it is not set. executor is created by new_executor.
+    """
+    handler = handlers.get("batch_handler")
+    if handler is None:
+        return None
+
+    if inspect.isgeneratorfunction(handler) or inspect.isasyncgenfunction(handler):
+        raise ValueError("batch_handler should return a list of results, generator is not supported")
+    if get_executor_type(handlers) == ExecutorType.Process:
+        logger.warn(f"batch_handler is not supported by executor {ExecutorType.Process.value}, run it in event loop")
+
+    max_batch_size = _get_positive_int(handlers, "max_batch_size", DEFAULT_MAX_BATCH_SIZE)
+    max_wait_ms = _get_positive_int(handlers, "max_wait_ms", DEFAULT_MAX_WAIT_MS)
+    logger.info(f"use batch handler, max batch size: {max_batch_size}, max wait: {max_wait_ms}ms")
+    return BatchScheduler(handler, env, max_batch_size, max_wait_ms, executor)
@@ -0,0 +1,3 @@
+"""
+Tools to measure spirit-gpu worker performance against a local stand-in agent.
+"""
@@ -0,0 +1,231 @@
+import asyncio
+import base64
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+from aiohttp import web
+
+from .. import settings
+from ..task import MsgHeaderKey, Operation
+from ..utils import current_unix_milli
+
+
+@dataclass
+class AgentStats:
+    # number of GET /apis/v1/request received, and how many of them returned no task
+    polls: int = 0
+    empty_polls: int = 0
+    # number of POST /apis/v1/request-report received
+    batch_reports: int = 0
+
+    # monotonic timestamps in seconds, keyed by request id
+    enqueued: Dict[str, float] = field(default_factory=dict)
+    picked: Dict[str, float] = field(default_factory=dict)
+    acked: Dict[str, float] = field(default_factory=dict)
+
+    def pickup_latencies(self) -> List[float]:
+        """
+        Milliseconds between a task being enqueued and the worker fetching it.
+        """
+        return [
+            (self.picked[request_id] - ts) * 1000
+            for request_id, ts in self.enqueued.items()
+            if request_id in self.picked
+        ]
+
+
+class FakeAgent:
+    """
+    In-process stand-in for the spirit agent, serving the worker side of the agent APIs.
+    """
+
+    def __init__(
+        self,
+        long_poll: bool = True,
+        batch_report: bool = True,
+        binary_result: bool = True,
+        result_chunk: bool = True,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.long_poll = long_poll
+        self.batch_report = batch_report
+        self.binary_result = binary_result
+        self.result_chunk = result_chunk
+        # sent to worker with every task, worker exits once agent is unhealthy and it has no task left
+        self.healthy = True
+        self.host = host
+        self.port = port
+        self.stats = AgentStats()
+        self.url = ""
+
+        self.results: Dict[str, bytes] = {}
+        # status code, message and data of results sent as raw body
+        self.binary_results: Dict[str, Tuple[int, str, bytes]] = {}
+        self.result_chunks: Dict[str, List[Dict[str, Any]]] = {}
+        self.statuses: Dict[str, List[Dict[str, Any]]] = {}
+
+        self._queue: Optional[asyncio.Queue[Dict[str, Any]]] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._acked: Optional[asyncio.Event] = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._acked = asyncio.Event()
+
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_get("/apis/v1/request", self._get_request)
+        app.router.add_post("/apis/v1/request-ack/{request_id}", self._ack)
+        app.router.add_post("/apis/v1/request-metric/{request_id}", self._status)
+        app.router.add_post("/apis/v1/request-result/{request_id}", self._result)
+        app.router.add_post("/apis/v1/heartbeat", self._heartbeat)
+        if self.result_chunk:
+            app.router.add_post("/apis/v1/request-result-chunk/{request_id}", self._result_chunk)
+        if self.binary_result:
+            app.router.add_post("/apis/v1/request-result-binary/{request_id}", self._binary_result)
+        if self.batch_report:
+            app.router.add_post("/apis/v1/request-report", self._report)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def submit(
+        self,
+        body: Any,
+        ttl: int = 600000,
+        mode: str = Operation.Sync.value,
+        webhook: str = "",
+    ) -> str:
+        """
+        Enqueue a task, body is either raw bytes or an object serialized to json.
+        Return the request id of the task.
+        """
+        assert self._queue is not None, "agent is not started"
+        if not isinstance(body, (bytes, bytearray)):
+            body = json.dumps(body).encode()
+
+        request_id = str(uuid.uuid4())
+        now = current_unix_milli()
+        headers = {
+            MsgHeaderKey.Mode.value: mode,
+            MsgHeaderKey.Webhook.value: webhook,
+            MsgHeaderKey.RequestID.value: request_id,
+            MsgHeaderKey.EnqueueAt.value: str(now),
+            MsgHeaderKey.CreateAt.value: str(now),
+            MsgHeaderKey.TTL.value: str(ttl),
+        }
+        self.stats.enqueued[request_id] = time.monotonic()
+        self._queue.put_nowait(
+            {"headers": headers, "body": base64.b64encode(body).decode("utf-8")}
+        )
+        return request_id
+
+    async def wait_acked(self, count: int, timeout: float):
+        """
+        Wait until at least count tasks are acked by worker.
+        """
+        assert self._acked is not None, "agent is not started"
+        acked = self._acked
+
+        async def wait():
+            while len(self.stats.acked) < count:
+                acked.clear()
+                await acked.wait()
+
+        await asyncio.wait_for(wait(), timeout)
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {settings.HEADER_HEALTH: "true" if self.healthy else "false"}
+        if self.long_poll:
+            headers[settings.HEADER_LONG_POLL] = "true"
+        return headers
+
+    async def _get_request(self, request: web.Request):
+        assert self._queue is not None
+        self.stats.polls += 1
+
+        wait = request.query.get("wait")
+        count = request.query.get("count")
+        try:
+            if self.long_poll and wait is not None:
+                first = await asyncio.wait_for(self._queue.get(), int(wait) / 1000)
+            else:
+                first = self._queue.get_nowait()
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            self.stats.empty_polls += 1
+            return web.Response(status=404, headers=self._headers())
+
+        tasks = [first]
+        while count is not None and len(tasks) < int(count) and not self._queue.empty():
+            tasks.append(self._queue.get_nowait())
+
+        now = time.monotonic()
+        for task in tasks:
+            self.stats.picked[task["headers"][MsgHeaderKey.RequestID.value]] = now
+
+        if count is None:
+            return web.json_response(first, headers=self._headers())
+        return web.json_response({"requests": tasks}, headers=self._headers())
+
+    def _record_ack(self, request_id: str):
+        assert self._acked is not None
+        self.stats.acked[request_id] = time.monotonic()
+        self._acked.set()
+
+    def _record_status(self, request_id: str, data: bytes):
+        self.statuses.setdefault(request_id, []).append(json.loads(data))
+
+    def _record_result(self, request_id: str, data: bytes):
+        self.results[request_id] = data
+
+    async def _ack(self, request: web.Request):
+        self._record_ack(request.match_info["request_id"])
+        return web.Response()
+
+    async def _status(self, request: web.Request):
+        self._record_status(request.match_info["request_id"], await request.read())
+        return web.Response()
+
+    async def _result(self, request: web.Request):
+        self._record_result(request.match_info["request_id"], await request.read())
+        return web.Response()
+
+    async def _binary_result(self, request: web.Request):
+        status_code = int(request.headers[settings.HEADER_RESULT_STATUS_CODE])
+        message = unquote(request.headers.get(settings.HEADER_RESULT_MESSAGE, ""))
+        self.binary_results[request.match_info["request_id"]] = (status_code, message, await request.read())
+        return web.Response()
+
+    async def _report(self, request: web.Request):
+        body = json.loads(await request.read())
+        self.stats.batch_reports += 1
+        for report in body["reports"]:
+            request_id = report["requestID"]
+            data = base64.b64decode(report["data"])
+            if report["type"] == "status":
+                self._record_status(request_id, data)
+            elif report["type"] == "result":
+                self._record_result(request_id, data)
+            else:
+                self._record_ack(request_id)
+        return web.Response()
+
+    async def _result_chunk(self, request: web.Request):
+        chunk = json.loads(await request.read())
+        self.result_chunks.setdefault(request.match_info["request_id"], []).append(chunk)
+        return web.Response()
+
+    async def _heartbeat(self, request: web.Request):
+        return web.Response()
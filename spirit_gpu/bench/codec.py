@@ -0,0 +1,78 @@
+"""
+Micro-benchmark of per-request JSON encode and decode cost, standard library json against spirit_gpu.codec.
+
+    python -m spirit_gpu.bench.codec
+"""
+
+import argparse
+import base64
+import dataclasses
+import json
+import timeit
+from typing import Any, Callable, Dict, List
+
+from .. import codec
+from ..task import MsgHeader
+from ..worker import getStatus
+
+
+def _payloads(size_mb: int) -> Dict[str, Any]:
+    header = MsgHeader("sync", "", "aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee", "", 1700000000000, 1700000000000, 600000)
+    blob = b"\x00" * (size_mb * 1024 * 1024)
+    return {
+        "request": {"input": {"prompt": "a photo of a cat", "steps": 30, "seed": 42}, "webhook": "http://localhost/hook"},
+        "status": getStatus(header, 1700000000100, "", "succeed", 100, 2000, 2100, "succeed"),
+        "table": {"rows": [{"id": i, "score": i / 7, "label": f"label-{i}"} for i in range(size_mb * 20000)]},
+        "envelope": {"statusCode": 200, "message": "", "data": base64.b64encode(blob).decode("utf-8")},
+    }
+
+
+def _time(fn: Callable[[], Any]) -> float:
+    """
+    Return best of 3 in microseconds per call.
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number * 1e6
+
+
+def run(size_mb: int) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for name, obj in _payloads(size_mb).items():
+        if dataclasses.is_dataclass(obj):
+            # RequestStatus, compare with the previous asdict based encoding
+            std_encode: Callable[[], Any] = lambda obj=obj: json.dumps(dataclasses.asdict(obj)).encode()
+            fast_encode: Callable[[], Any] = lambda obj=obj: obj.json()
+            encoded = obj.json()
+        else:
+            std_encode = lambda obj=obj: json.dumps(obj).encode()
+            fast_encode = lambda obj=obj: codec.dumps(obj)
+            encoded = codec.dumps(obj)
+
+        std_decode: Callable[[], Any] = lambda encoded=encoded: json.loads(encoded)
+        fast_decode: Callable[[], Any] = lambda encoded=encoded: codec.loads(encoded)
+        results.append(
+            {
+                "payload": name,
+                "bytes": len(encoded),
+                "encodeUs": {"json": round(_time(std_encode), 2), codec.NAME: round(_time(fast_encode), 2)},
+                "decodeUs": {"json": round(_time(std_decode), 2), codec.NAME: round(_time(fast_decode), 2)},
+            }
+        )
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Measure JSON encode and decode cost of spirit_gpu codec.")
+    parser.add_argument("--size-mb", type=int, default=4, help="Size of the large payloads in MB.")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    for result in run(args.size_mb):
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
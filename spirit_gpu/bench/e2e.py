@@ -0,0 +1,244 @@
+"""
+End-to-end benchmark of the worker loop against a local stand-in agent and webhook.
+
+    python -m spirit_gpu.bench.e2e --handler sync,async,generator --concurrency 1,8 --rate 0,50
+
+Every combination of the comma separated options runs in its own process, because worker settings
+and heartbeat are process wide. Each run prints one line of json:
+
+    throughput: acked requests per second, from the first submitted request to the last acked one
+    pickupLatencyMs: from a request being enqueued to the worker fetching it
+    endToEndMs: from a request being enqueued to it being acked
+    overheadMs: from the worker fetching a request to it being acked, minus the time spent in handler,
+        null with executor process, whose handler runs and records its time in another process
+    webhookMs: from a request being enqueued to its result arriving at webhook, async mode only
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+from .. import settings, worker
+from ..conf import Config
+from ..env import Env
+from ..executor import ExecutorType
+from ..task import Operation
+from .agent import FakeAgent
+from .report import summarize
+from .webhook import FakeWebhook
+
+HANDLER_TYPES = ["sync", "async", "generator"]
+
+# monotonic start and end of handler, keyed by request id
+_handler_times: Dict[str, Tuple[float, float]] = {}
+
+
+def new_handler(handler_type: str, work_ms: int, result_bytes: int):
+    """
+    Return a handler of handler_type, spending work_ms and returning about result_bytes.
+    Generator handlers spread work and result over 4 items.
+    """
+    output = "x" * result_bytes
+    steps = 4
+    step_output = "x" * (result_bytes // steps)
+
+    def record(request: Dict[str, Any], start: float):
+        _handler_times[request["meta"]["requestID"]] = (start, time.monotonic())
+
+    if handler_type == "sync":
+
+        def sync_handler(request: Dict[str, Any], env: Env):
+            start = time.monotonic()
+            time.sleep(work_ms / 1000)
+            record(request, start)
+            return {"output": output}
+
+        return sync_handler
+
+    if handler_type == "async":
+
+        async def async_handler(request: Dict[str, Any], env: Env):
+            start = time.monotonic()
+            await asyncio.sleep(work_ms / 1000)
+            record(request, start)
+            return {"output": output}
+
+        return async_handler
+
+    def generator_handler(request: Dict[str, Any], env: Env):
+        start = time.monotonic()
+        for _ in range(steps):
+            time.sleep(work_ms / 1000 / steps)
+            yield {"output": step_output}
+        record(request, start)
+
+    return generator_handler
+
+
+async def measure(
+    handler_type: str,
+    executor: str,
+    concurrency: int,
+    rate: float,
+    tasks: int,
+    payload_bytes: int,
+    result_bytes: int,
+    work_ms: int,
+    mode: str,
+    fetch_mode: str,
+    webhook_delay_ms: int,
+) -> Dict[str, Any]:
+    os.environ[settings.EASE_FETCH_MODE] = fetch_mode
+    agent = FakeAgent(long_poll=fetch_mode == settings.FETCH_MODE_LONG_POLL)
+    await agent.start()
+    settings.SETTINGS._agent_url = agent.url
+    webhook = FakeWebhook(delay_ms=webhook_delay_ms)
+    await webhook.start()
+
+    handlers = {
+        "handler": new_handler(handler_type, work_ms, result_bytes),
+        "executor": executor,
+        "max_workers": concurrency,
+        "concurrency_modifier": lambda _: concurrency,
+    }
+    worker_task = asyncio.create_task(worker.run(handlers, Env(Config())))
+    try:
+        # let worker finish init before submitting requests
+        await asyncio.sleep(0.5)
+
+        body: Dict[str, Any] = {"input": {"payload": "x" * payload_bytes}}
+        if mode == Operation.Async.value:
+            body["webhook"] = webhook.url
+        start = time.monotonic()
+        for i in range(tasks):
+            if rate > 0:
+                # open loop arrival, submit on schedule no matter how fast worker is
+                delay = start + i / rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            agent.submit(body, mode=mode)
+        await agent.wait_acked(tasks, timeout=max(60, tasks * work_ms / 1000 * 2))
+    finally:
+        worker_task.cancel()
+        await asyncio.gather(worker_task, return_exceptions=True)
+        await worker.WORKER.task_manager.close()
+        await worker.WORKER.session.close()
+        await webhook.stop()
+        await agent.stop()
+
+    stats = agent.stats
+    end_to_end: List[float] = []
+    overhead: List[float] = []
+    webhook_latencies: List[float] = []
+    for request_id, enqueued in stats.enqueued.items():
+        total = (stats.acked[request_id] - enqueued) * 1000
+        end_to_end.append(total)
+        if request_id in _handler_times:
+            handler_start, handler_end = _handler_times[request_id]
+            in_worker = stats.acked[request_id] - stats.picked[request_id]
+            overhead.append((in_worker - (handler_end - handler_start)) * 1000)
+        if request_id in webhook.received:
+            webhook_latencies.append((webhook.received[request_id] - enqueued) * 1000)
+
+    elapsed = max(stats.acked.values()) - start
+    result: Dict[str, Any] = {
+        "handler": handler_type,
+        "executor": executor,
+        "concurrency": concurrency,
+        "rate": rate,
+        "tasks": tasks,
+        "payloadBytes": payload_bytes,
+        "resultBytes": result_bytes,
+        "workMs": work_ms,
+        "mode": mode,
+        "fetchMode": fetch_mode,
+        "throughput": round(tasks / elapsed, 3),
+        "pickupLatencyMs": summarize(stats.pickup_latencies()),
+        "endToEndMs": summarize(end_to_end),
+        "overheadMs": None if executor == ExecutorType.Process.value else summarize(overhead),
+    }
+    if mode == Operation.Async.value:
+        result["webhookMs"] = summarize(webhook_latencies)
+    return result
+
+
+def _split(value: str, type: Any) -> List[Any]:
+    return [type(v) for v in value.split(",") if v != ""]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Measure throughput and per-request overhead of worker end to end.")
+    parser.add_argument("--handler", default="async", help=f"Comma separated handler types: {', '.join(HANDLER_TYPES)}.")
+    parser.add_argument("--executor", default="inline", help="Comma separated executors, see handler option executor.")
+    parser.add_argument("--concurrency", default="1", help="Comma separated max concurrency.")
+    parser.add_argument("--rate", default="0", help="Comma separated requests per second, 0 submits all at once.")
+    parser.add_argument("--payload-bytes", default="100", help="Comma separated size of request input.")
+    parser.add_argument("--result-bytes", default="100", help="Comma separated size of handler result.")
+    parser.add_argument("--work-ms", type=int, default=10, help="Milliseconds each request spends in handler.")
+    parser.add_argument("--tasks", type=int, default=200, help="Number of requests of each run.")
+    parser.add_argument("--mode", choices=[Operation.Sync.value, Operation.Async.value], default=Operation.Sync.value)
+    parser.add_argument(
+        "--fetch-mode",
+        choices=[settings.FETCH_MODE_POLL, settings.FETCH_MODE_LONG_POLL],
+        default=settings.FETCH_MODE_LONG_POLL,
+    )
+    parser.add_argument("--webhook-delay-ms", type=int, default=0, help="Milliseconds webhook takes to respond.")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    handler_types = _split(args.handler, str)
+    for handler_type in handler_types:
+        if handler_type not in HANDLER_TYPES:
+            raise ValueError(f"unknown handler type {handler_type}")
+    runs = list(
+        itertools.product(
+            handler_types,
+            _split(args.executor, str),
+            _split(args.concurrency, int),
+            _split(args.rate, float),
+            _split(args.payload_bytes, int),
+            _split(args.result_bytes, int),
+        )
+    )
+
+    if len(runs) == 1:
+        handler_type, executor, concurrency, rate, payload_bytes, result_bytes = runs[0]
+        result = asyncio.run(
+            measure(
+                handler_type, executor, concurrency, rate, args.tasks, payload_bytes, result_bytes,
+                args.work_ms, args.mode, args.fetch_mode, args.webhook_delay_ms,
+            )
+        )
+        print(json.dumps(result))
+        return
+
+    for handler_type, executor, concurrency, rate, payload_bytes, result_bytes in runs:
+        cmd = [
+            sys.executable, "-m", __spec__.name,
+            "--handler", handler_type,
+            "--executor", executor,
+            "--concurrency", str(concurrency),
+            "--rate", str(rate),
+            "--payload-bytes", str(payload_bytes),
+            "--result-bytes", str(result_bytes),
+            "--work-ms", str(args.work_ms),
+            "--tasks", str(args.tasks),
+            "--mode", args.mode,
+            "--fetch-mode", args.fetch_mode,
+            "--webhook-delay-ms", str(args.webhook_delay_ms),
+        ]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        # worker logs go to stdout as well, result is the last line
+        print(output.strip().splitlines()[-1], flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Measure import time of spirit_gpu and fail if it exceeds a budget, to keep worker cold start fast.
+
+    python -m spirit_gpu.bench.imports --budget-ms 100
+
+Every run imports the module in a fresh interpreter, the median of the runs is compared with the budget.
+It also fails if importing spirit_gpu loads a module which only the worker, the test server or the builder needs.
+Exit code is 1 if the check fails, so it can be run in CI.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Tuple
+
+# needed by worker, test server or builder, `import spirit_gpu` should not load them
+DEFAULT_FORBIDDEN = ["aiohttp", "requests", "backoff", "yaml", "datamodel_code_generator", "spirit_gpu.worker"]
+
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _parse_importtime(stderr: str, module: str) -> List[Tuple[str, int]]:
+    """
+    Return modules imported directly by module, with their cumulative microseconds.
+    """
+    children: List[Tuple[str, int]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # a module is printed after the modules it imports, nested ones are indented by two more spaces
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                return children
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), int(cumulative)))
+    return []
+
+
+def measure_once(module: str) -> Tuple[float, List[str], List[Tuple[str, int]]]:
+    cmd = [sys.executable, "-X", "importtime", "-c", _MEASURE.format(module=module)]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    # spirit_gpu may log to stdout, result is the last line
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    return result["ms"], result["modules"], _parse_importtime(output.stderr, module)
+
+
+def measure(module: str, runs: int, forbidden: List[str]) -> Dict[str, Any]:
+    times: List[float] = []
+    modules: List[str] = []
+    slowest: List[Tuple[str, int]] = []
+    for _ in range(runs):
+        ms, modules, imports = measure_once(module)
+        times.append(ms)
+        slowest = sorted(imports, key=lambda item: item[1], reverse=True)[:10]
+    return {
+        "module": module,
+        "runs": runs,
+        "medianMs": round(statistics.median(times), 3),
+        "minMs": round(min(times), 3),
+        "maxMs": round(max(times), 3),
+        "forbiddenLoaded": [name for name in forbidden if name in modules],
+        "slowestMs": {name: round(us / 1000, 3) for name, us in slowest},
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Measure import time of spirit_gpu and check it against a budget.")
+    parser.add_argument("--module", default="spirit_gpu", help="Module to import.")
+    parser.add_argument("--budget-ms", type=float, default=100, help="Max median milliseconds to import the module.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters to import the module.")
+    parser.add_argument(
+        "--forbid",
+        default=",".join(DEFAULT_FORBIDDEN),
+        help="Comma separated modules which should not be loaded by the import, empty to skip the check.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    forbidden = [name for name in args.forbid.split(",") if name != ""]
+    result = measure(args.module, max(1, args.runs), forbidden)
+    result["budgetMs"] = args.budget_ms
+    result["ok"] = result["medianMs"] <= args.budget_ms and len(result["forbiddenLoaded"]) == 0
+    print(json.dumps(result))
+    if not result["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
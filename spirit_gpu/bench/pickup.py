@@ -0,0 +1,94 @@
+"""
+Measure task pickup latency and idle request rate of the worker loop against a local stand-in agent.
+
+    python -m spirit_gpu.bench.pickup --mode both
+
+Each mode runs in its own process, because worker settings and heartbeat are process wide.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict
+
+from .. import settings, worker
+from ..conf import Config
+from ..env import Env
+from .agent import FakeAgent
+from .report import summarize
+
+
+def _handler(request: Dict[str, Any], env: Env):
+    return {"output": "ok"}
+
+
+async def measure(mode: str, idle_seconds: float, tasks: int, interval: float) -> Dict[str, Any]:
+    os.environ[settings.EASE_FETCH_MODE] = mode
+    agent = FakeAgent(long_poll=mode == settings.FETCH_MODE_LONG_POLL)
+    await agent.start()
+    settings.SETTINGS._agent_url = agent.url
+
+    worker_task = asyncio.create_task(worker.run({"handler": _handler}, Env(Config())))
+    try:
+        # let worker finish init before counting requests
+        await asyncio.sleep(0.5)
+        polls = agent.stats.polls
+        await asyncio.sleep(idle_seconds)
+        idle_rate = (agent.stats.polls - polls) / idle_seconds
+
+        for _ in range(tasks):
+            agent.submit({"input": {}})
+            await asyncio.sleep(interval)
+        await agent.wait_acked(tasks, timeout=60)
+    finally:
+        worker_task.cancel()
+        await asyncio.gather(worker_task, return_exceptions=True)
+        await worker.WORKER.task_manager.close()
+        await worker.WORKER.session.close()
+        await agent.stop()
+
+    return {
+        "mode": mode,
+        "idleRequestsPerSecond": round(idle_rate, 3),
+        "pickupLatencyMs": summarize(agent.stats.pickup_latencies()),
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Measure task pickup latency and idle request rate of worker.")
+    parser.add_argument(
+        "--mode",
+        choices=[settings.FETCH_MODE_POLL, settings.FETCH_MODE_LONG_POLL, "both"],
+        default="both",
+    )
+    parser.add_argument("--idle-seconds", type=float, default=5, help="Seconds to count requests with an empty queue.")
+    parser.add_argument("--tasks", type=int, default=50, help="Number of tasks to measure pickup latency.")
+    parser.add_argument("--interval", type=float, default=0.1, help="Seconds between two submitted tasks.")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.mode != "both":
+        result = asyncio.run(measure(args.mode, args.idle_seconds, args.tasks, args.interval))
+        print(json.dumps(result))
+        return
+
+    for mode in [settings.FETCH_MODE_POLL, settings.FETCH_MODE_LONG_POLL]:
+        cmd = [
+            sys.executable, "-m", __spec__.name,
+            "--mode", mode,
+            "--idle-seconds", str(args.idle_seconds),
+            "--tasks", str(args.tasks),
+            "--interval", str(args.interval),
+        ]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        # worker logs go to stdout as well, result is the last line
+        print(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Replay tasks recorded by EASE_RECORD_FILE to a worker through a local stand-in agent.
+
+    python -m spirit_gpu.bench.replay tasks.ndjson.gz --speed 1 --port 8087
+    EASE_AGENT_URL=http://127.0.0.1:8087 python handler.py
+
+Tasks are submitted following their original enqueue timestamps. --speed 2 replays twice as fast,
+--speed 0 submits all tasks at once. Webhooks of async requests are pointed to a local sink.
+Use --handler module:function to run the worker in this process instead of starting one.
+When all tasks are acked, one line of json is printed, see spirit_gpu.bench.e2e for its fields.
+"""
+
+import argparse
+import asyncio
+import base64
+import importlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from .. import codec, settings, worker
+from ..conf import Config
+from ..env import Env
+from ..record import read_records
+from ..task import MsgHeader, Operation
+from .agent import FakeAgent
+from .report import summarize
+from .webhook import FakeWebhook
+
+
+def _body(record: Dict[str, Any], header: MsgHeader, webhook: str) -> bytes:
+    if "body" in record:
+        body = base64.b64decode(record["body"])
+    else:
+        # body is redacted, send a request of about the same size
+        request: Any = {"input": {"redacted": ""}}
+        if header.mode == Operation.Async.value:
+            request["webhook"] = ""
+        request["input"]["redacted"] = "*" * max(0, record["size"] - len(codec.dumps(request)))
+        body = codec.dumps(request)
+
+    try:
+        request = codec.loads(body)
+    except Exception:
+        return body
+    if isinstance(request, dict) and "webhook" in request:
+        request["webhook"] = webhook
+        return codec.dumps(request)
+    return body
+
+
+def _load_handler(name: str):
+    module, _, attr = name.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+async def replay(path: str, speed: float, port: int, handler: Optional[str], timeout: float) -> Dict[str, Any]:
+    records = list(read_records(path))
+    records.sort(key=lambda record: MsgHeader.parse(record["headers"]).enqueue_at)
+
+    agent = FakeAgent(long_poll=True, port=port)
+    await agent.start()
+    webhook = FakeWebhook()
+    await webhook.start()
+
+    worker_task: Optional[asyncio.Task[None]] = None
+    if handler is not None:
+        os.environ.setdefault(settings.EASE_FETCH_MODE, settings.FETCH_MODE_LONG_POLL)
+        settings.SETTINGS._agent_url = agent.url
+        worker_task = asyncio.create_task(worker.run({"handler": _load_handler(handler)}, Env(Config())))
+        # let worker finish init before submitting requests
+        await asyncio.sleep(0.5)
+    else:
+        print(f"stand-in agent is listening on {agent.url}, waiting for worker", flush=True)
+
+    try:
+        first_enqueue = MsgHeader.parse(records[0]["headers"]).enqueue_at if records else 0
+        start = time.monotonic()
+        for record in records:
+            header = MsgHeader.parse(record["headers"])
+            if speed > 0:
+                delay = start + (header.enqueue_at - first_enqueue) / 1000 / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            agent.submit(
+                _body(record, header, webhook.url),
+                ttl=header.ttl,
+                mode=header.mode or Operation.Sync.value,
+                webhook=webhook.url if header.webhook != "" else "",
+            )
+        await agent.wait_acked(len(records), timeout=timeout)
+    finally:
+        if worker_task is not None:
+            worker_task.cancel()
+            await asyncio.gather(worker_task, return_exceptions=True)
+            await worker.WORKER.task_manager.close()
+            await worker.WORKER.session.close()
+        await webhook.stop()
+        await agent.stop()
+
+    stats = agent.stats
+    end_to_end: List[float] = [(stats.acked[request_id] - ts) * 1000 for request_id, ts in stats.enqueued.items()]
+    elapsed = max(stats.acked.values()) - start if stats.acked else 0
+    return {
+        "file": path,
+        "speed": speed,
+        "tasks": len(records),
+        "bodyBytes": sum(record["size"] for record in records),
+        "throughput": round(len(records) / elapsed, 3) if elapsed > 0 else 0.0,
+        "pickupLatencyMs": summarize(stats.pickup_latencies()),
+        "endToEndMs": summarize(end_to_end),
+        "webhookResults": len(webhook.received),
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Replay recorded tasks to a worker through a stand-in agent.")
+    parser.add_argument("file", help="File written by EASE_RECORD_FILE.")
+    parser.add_argument("--speed", type=float, default=1, help="Replay speed relative to recorded arrivals, 0 for max speed.")
+    parser.add_argument("--port", type=int, default=8087, help="Port of the stand-in agent.")
+    parser.add_argument("--handler", default=None, help="Run worker in this process with handler module:function.")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds to wait for all tasks to be acked.")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    result = asyncio.run(replay(args.file, args.speed, args.port, args.handler, args.timeout))
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import math
+from typing import Dict, List
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile, p in [0, 100]. Return 0 for empty values.
+    """
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(max(values), 3) if values else 0.0,
+    }
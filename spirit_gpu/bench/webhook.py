@@ -0,0 +1,49 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class FakeWebhook:
+    """
+    In-process webhook sink, recording when the result of each request arrives.
+    """
+
+    def __init__(self, delay_ms: int = 0, status: int = 200, host: str = "127.0.0.1", port: int = 0):
+        self.delay_ms = delay_ms
+        self.status = status
+        self.host = host
+        self.port = port
+        self.url = ""
+
+        # monotonic timestamps in seconds, keyed by request id
+        self.received: Dict[str, float] = {}
+        self.status_codes: Dict[str, int] = {}
+        self.bytes_received = 0
+
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_post("/", self._receive)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}/"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _receive(self, request: web.Request):
+        body = await request.read()
+        if self.delay_ms > 0:
+            await asyncio.sleep(self.delay_ms / 1000)
+        request_id = request.query.get("requestID", "")
+        self.received[request_id] = time.monotonic()
+        self.status_codes[request_id] = int(request.query.get("statusCode", "0"))
+        self.bytes_received += len(body)
+        return web.Response(status=self.status)
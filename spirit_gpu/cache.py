@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import codec, metrics
+from .log import logger
+from .task import ResultData
+
+DEFAULT_CACHE_TTL = 0
+DEFAULT_DISK_BYTES = 10 * 1024 * 1024 * 1024
+
+CACHE_HITS = metrics.counter("spirit_result_cache_hits_total", "Requests answered by result cache.", ["tier"])
+CACHE_MISSES = metrics.counter("spirit_result_cache_misses_total", "Requests not found in result cache.")
+CACHE_MEMORY_BYTES = metrics.gauge("spirit_result_cache_memory_bytes", "Bytes of results held in memory by result cache.")
+CACHE_ENTRIES = metrics.gauge("spirit_result_cache_entries", "Number of results held in memory by result cache.")
+
+
+def fingerprint(input: Any, version: str) -> str:
+    """
+    Hash of request input and handler version. Keys of objects are sorted, so the same input always has the same hash.
+    """
+    h = hashlib.sha256()
+    h.update(version.encode())
+    h.update(b"\x00")
+    h.update(codec.dumps_sorted(input))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Results of a deterministic handler, keyed by fingerprint of their input.
+
+    Memory tier keeps at most max_bytes of results and evicts the least recently used ones.
+    Disk tier is optional, it keeps every result and removes the oldest ones when it exceeds disk_bytes.
+    Results older than ttl seconds are never returned, 0 means they do not expire.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = DEFAULT_CACHE_TTL, directory: str = "", disk_bytes: int = DEFAULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+
+        # key -> (result, stored at in monotonic seconds)
+        self._memory: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._memory_bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # bytes in directory, counted on first write
+        self._disk_total: Optional[int] = None
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        CACHE_MEMORY_BYTES.set_function(lambda: self._memory_bytes)
+        CACHE_ENTRIES.set_function(lambda: len(self._memory))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups > 0 else 0.0,
+            "entries": len(self._memory),
+            "memoryBytes": self._memory_bytes,
+        }
+
+    async def get(self, key: str) -> Optional[bytes]:
+        result = self._get_memory(key)
+        if result is not None:
+            self.hits += 1
+            CACHE_HITS.labels("memory").inc()
+            return result
+
+        if self.directory != "":
+            loop = asyncio.get_running_loop()
+            try:
+                entry = await loop.run_in_executor(None, self._read, key)
+            except Exception as e:
+                logger.error(f"failed to read result cache {key}, err: {e}")
+                entry = None
+            if entry is not None:
+                result, age = entry
+                self.hits += 1
+                self.disk_hits += 1
+                CACHE_HITS.labels("disk").inc()
+                self._put_memory(key, result, time.monotonic() - age)
+                return result
+
+        self.misses += 1
+        CACHE_MISSES.inc()
+        return None
+
+    async def put(self, key: str, data: ResultData):
+        result = bytes(data)
+        self._put_memory(key, result, time.monotonic())
+        if self.directory != "":
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write, key, result)
+            except Exception as e:
+                logger.error(f"failed to write result cache {key}, err: {e}")
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - stored_at > self.ttl
+
+    def _get_memory(self, key: str) -> Optional[bytes]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        result, stored_at = entry
+        if self._expired(stored_at, time.monotonic()):
+            self._remove_memory(key)
+            return None
+        self._memory.move_to_end(key)
+        return result
+
+    def _put_memory(self, key: str, result: bytes, stored_at: float):
+        if len(result) > self.max_bytes:
+            return
+        self._remove_memory(key)
+        self._memory[key] = (result, stored_at)
+        self._memory_bytes += len(result)
+        while self._memory_bytes > self.max_bytes:
+            oldest = next(iter(self._memory))
+            self._remove_memory(oldest)
+
+    def _remove_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[0])
+
+    def _read(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """
+        Return result and its age in seconds.
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            # monotonic clock is per process, disk entries are aged by their modification time
+            age = time.time() - os.path.getmtime(path)
+            if self.ttl > 0 and age > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                return f.read(), age
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key: str, result: bytes):
+        path = os.path.join(self.directory, key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".{key}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(result)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        if self._disk_total is not None:
+            self._disk_total += len(result)
+        if self._disk_total is None or self._disk_total > self.disk_bytes:
+            self._disk_total = self._evict_disk()
+
+    def _evict_disk(self) -> int:
+        """
+        Remove oldest files until directory fits in disk_bytes, return bytes left.
+        """
+        entries: List[Tuple[float, int, str]] = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.disk_bytes:
+            return total
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+
+def _get_number(handlers: Dict[str, Any], key: str, default: float) -> float:
+    value = handlers.get(key, default)
+    try:
+        v = float(value)
+        if v < 0:
+            raise ValueError(f"{key} should not be negative")
+    except Exception as e:
+        logger.error(f"invalid {key} {value}, use default {default}, err: {e}")
+        v = default
+    return v
+
+
+def new_result_cache(handlers: Dict[str, Any]) -> Optional[ResultCache]:
+    """
+    Create cache if handlers["result_cache_bytes"] is set, None otherwise.
+    """
+    max_bytes = int(_get_number(handlers, "result_cache_bytes", 0))
+    if max_bytes <= 0:
+        return None
+    ttl = _get_number(handlers, "result_cache_ttl", DEFAULT_CACHE_TTL)
+    directory = str(handlers.get("result_cache_dir", ""))
+    disk_bytes = int(_get_number(handlers, "result_cache_disk_bytes", DEFAULT_DISK_BYTES))
+    logger.info(f"cache results, memory: {max_bytes} bytes, ttl: {ttl}s, directory: {directory or 'none'}")
+    return ResultCache(max_bytes, ttl, directory, disk_bytes)
+
+
+def handler_version(handlers: Dict[str, Any]) -> str:
+    return str(handlers.get("handler_version", ""))
@@ -0,0 +1,63 @@
+"""
+JSON codec used on the request path.
+
+orjson is used if it is installed (`pip install spirit-gpu[fast]`), otherwise the standard library json.
+Objects orjson cannot encode, e.g. integers larger than 64 bits, are encoded by the standard library.
+Bodies orjson cannot decode, e.g. with NaN or Infinity which Python clients write by default, are decoded by
+the standard library. orjson encodes NaN and Infinity as null.
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _std_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode()
+
+
+def _std_dumps_sorted(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode()
+
+
+def _std_loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    return json.loads(data)
+
+
+if orjson is not None:
+    NAME = "orjson"
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=_OPTIONS)
+        except TypeError:
+            return _std_dumps(obj)
+
+    def dumps_sorted(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=_OPTIONS | orjson.OPT_SORT_KEYS)
+        except TypeError:
+            return _std_dumps_sorted(obj)
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return _std_loads(data)
+
+else:  # pragma: no cover
+    NAME = "json"
+    dumps = _std_dumps
+    dumps_sorted = _std_dumps_sorted
+    loads = _std_loads
+
+
+def dumps_str(obj: Any) -> str:
+    return dumps(obj).decode()
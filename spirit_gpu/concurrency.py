@@ -1,16 +1,30 @@
+import asyncio
 from typing import Callable, Optional
 from .log import logger
 
 
 class Concurrency:
-    def __init__(self, concurrency_modifier: Optional[Callable[[int], int]]):
+    def __init__(self, concurrency_modifier: Optional[Callable[[int], int]], max_concurrency: Optional[int] = None):
+        """
+        max_concurrency: upper bound of allowed concurrency, e.g. size of the pool running handlers.
+        """
         if concurrency_modifier is not None:
             self.concurrency_modifier = concurrency_modifier
         else:
             self.concurrency_modifier: Callable[[int], int] = lambda x: x
 
         self.allowed_concurrency = 1
+        self.max_concurrency = max_concurrency
         self.current_jobs: set[str] = set()
+        # finished requests whose results are still being delivered, they do not take a slot
+        self.delivering_jobs: set[str] = set()
+        # requests waiting for the result of an identical running request, they do not take a slot
+        self.waiting_jobs: set[str] = set()
+        # requests fetched ahead and waiting for a slot
+        self.prefetched_jobs: set[str] = set()
+        self._warned_max = False
+        # set when a slot is freed, wakes up wait_available
+        self._changed = asyncio.Event()
 
     def is_available(self) -> bool:
         current = self.allowed_concurrency
@@ -20,18 +34,98 @@ class Concurrency:
         except Exception as e:
             logger.error(f"failed to call concurrency_modifier with input {current}, set concurrency to default 1, err: {e}", exc_info=True)
             self.allowed_concurrency = 1
+
+        if self.max_concurrency is not None and self.allowed_concurrency > self.max_concurrency:
+            if not self._warned_max:
+                logger.warn(f"concurrency_modifier returns {self.allowed_concurrency}, larger than max concurrency {self.max_concurrency}, use {self.max_concurrency}")
+                self._warned_max = True
+            self.allowed_concurrency = self.max_concurrency
         return len(self.current_jobs) < self.allowed_concurrency
 
+    async def wait_available(self, interval: float):
+        """
+        Wait until a job can be added. Allowed concurrency is evaluated again as soon as a slot is freed,
+        and every interval seconds in case concurrency_modifier raises it without any job finishing.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            self._changed.clear()
+            if self.is_available():
+                return
+            # not wait_for, it may swallow cancellation when the event is set at the same time
+            timer = loop.call_later(interval, self._changed.set)
+            try:
+                await self._changed.wait()
+            finally:
+                timer.cancel()
+
+    def notify(self):
+        """
+        Wake up wait_available to evaluate allowed concurrency again.
+        """
+        self._changed.set()
+
+    def free_slots(self) -> int:
+        """
+        Number of jobs can be added, based on the allowed concurrency of last is_available call.
+        """
+        return max(0, self.allowed_concurrency - len(self.current_jobs))
+
     def add_job(self, request_id: str):
+        self.prefetched_jobs.discard(request_id)
         self.current_jobs.add(request_id)
         logger.info(f"added, allowed concurrency: {self.allowed_concurrency}, current jobs: {len(self.current_jobs)}", request_id=request_id)
 
     def get_jobs(self):
-        return list(self.current_jobs)
+        return list(self.current_jobs) + list(self.prefetched_jobs) + list(self.waiting_jobs) + list(self.delivering_jobs)
+
+    def holds_slot(self, request_id: str) -> bool:
+        return request_id in self.current_jobs
+
+    def get_delivering_jobs(self):
+        return list(self.delivering_jobs)
+
+    def start_delivery(self, request_id: str):
+        """
+        Free the slot of request, keep it in jobs until finish_delivery is called.
+        """
+        self.delivering_jobs.add(request_id)
+        self.remove_job(request_id)
+
+    def finish_delivery(self, request_id: str):
+        self.delivering_jobs.discard(request_id)
+
+    def park(self, request_id: str):
+        """
+        Free the slot of request while it waits, keep it in jobs until unpark is called.
+        """
+        self.waiting_jobs.add(request_id)
+        self.remove_job(request_id)
+
+    def unpark(self, request_id: str):
+        """
+        Move parked request to delivering jobs, it still does not take a slot.
+        """
+        self.delivering_jobs.add(request_id)
+        self.waiting_jobs.discard(request_id)
+
+    def prefetch(self, request_id: str):
+        """
+        Keep fetched request in jobs until add_job or drop_prefetched is called.
+        """
+        self.prefetched_jobs.add(request_id)
+
+    def drop_prefetched(self, request_id: str):
+        """
+        Move prefetched request to delivering jobs without a slot, e.g. to report its expiry.
+        """
+        self.delivering_jobs.add(request_id)
+        self.prefetched_jobs.discard(request_id)
 
     def remove_job(self, request_id: str):
         try:
             self.current_jobs.remove(request_id)
         except Exception as e:
             logger.error(f"failed to remove request from concurrency, err: {e}", request_id=request_id, exc_info=True)
+        self.notify()
         logger.info(f"remove request from concurrency, allowed concurrency: {self.allowed_concurrency}, current jobs: {len(self.current_jobs)}", request_id=request_id) 
\ No newline at end of file
@@ -1,5 +1,4 @@
 from typing import Any, Dict
-import yaml
 
 
 class Config:
@@ -8,6 +7,9 @@ class Config:
 
 
 def load_config(filename: str) -> Config:
+    # only needed when config file is used, keep it out of import time
+    import yaml
+
     with open(filename, "r") as f:
         data: Any = yaml.safe_load(f) or {}
     config = Config(**data)
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from .concurrency import Concurrency
+from .log import logger
+from .settings import SETTINGS
+
+
+class DeliveryQueue:
+    """
+    Deliver results of finished requests in background, so their concurrency slots can be reused at once.
+
+    At most `concurrency` requests are delivered at the same time and at most `size` requests wait for delivery.
+    put() blocks when queue is full, which keeps the slot of the request busy and stops worker from taking more.
+    """
+
+    def __init__(self, concurrency: Concurrency, workers: int, size: int):
+        self._concurrency = concurrency
+        self._queue: asyncio.Queue[Tuple[str, Callable[[], Awaitable[None]]]] = asyncio.Queue(size)
+        self._workers: List[asyncio.Task[None]] = [asyncio.create_task(self._work()) for _ in range(workers)]
+
+    async def put(self, request_id: str, deliver: Callable[[], Awaitable[None]]):
+        """
+        deliver sends the result and acks the request.
+        """
+        await self._queue.put((request_id, deliver))
+
+    async def _work(self):
+        while True:
+            request_id, deliver = await self._queue.get()
+            try:
+                await deliver()
+            except Exception as e:
+                logger.error(f"failed to deliver request, err: {e}", request_id=request_id, exc_info=True)
+            finally:
+                self._concurrency.finish_delivery(request_id)
+                self._queue.task_done()
+
+
+def new_delivery_queue(concurrency: Concurrency) -> Optional[DeliveryQueue]:
+    workers = SETTINGS.delivery_concurrency()
+    if workers <= 0:
+        return None
+    size = SETTINGS.delivery_queue_size()
+    logger.info(f"deliver results in background, concurrency: {workers}, queue size: {size}")
+    return DeliveryQueue(concurrency, workers, size)
@@ -0,0 +1,57 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from enum import Enum
+from typing import Any, Dict, Optional
+
+from .log import logger
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class ExecutorType(Enum):
+    # run sync handlers in event loop
+    Inline = "inline"
+    # run sync handlers and each step of sync generators in a thread pool
+    Thread = "thread"
+    # run any handler in a pool of pre-forked processes, for CPU bound handlers
+    Process = "process"
+
+
+def get_executor_type(handlers: Dict[str, Any]) -> ExecutorType:
+    value = handlers.get("executor", ExecutorType.Inline.value)
+    try:
+        return ExecutorType(value)
+    except ValueError:
+        logger.error(f"invalid executor {value}, use default {ExecutorType.Inline.value}, available executors: {[e.value for e in ExecutorType]}")
+        return ExecutorType.Inline
+
+
+def uses_process_pool(handlers: Dict[str, Any]) -> bool:
+    """
+    Whether handler runs in a process pool, whose processes run setup, warmup and teardown themselves.
+    batch_handler runs in this process whatever the executor is.
+    """
+    return get_executor_type(handlers) == ExecutorType.Process and handlers.get("batch_handler") is None
+
+
+def get_max_workers(handlers: Dict[str, Any]) -> int:
+    value = handlers.get("max_workers", DEFAULT_MAX_WORKERS)
+    try:
+        max_workers = int(value)
+        if max_workers < 1:
+            raise ValueError("max_workers should be at least 1")
+    except Exception as e:
+        logger.error(f"invalid max_workers {value}, use default {DEFAULT_MAX_WORKERS}, err: {e}")
+        max_workers = DEFAULT_MAX_WORKERS
+    return max_workers
+
+
+def new_executor(handlers: Dict[str, Any]) -> Optional[Executor]:
+    """
+    Create the executor for sync handlers selected by handlers["executor"], None means run in event loop.
+    """
+    executor_type = get_executor_type(handlers)
+    if executor_type == ExecutorType.Thread:
+        max_workers = get_max_workers(handlers)
+        logger.info(f"run handler in thread pool, max workers: {max_workers}")
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="spirit-handler")
+    return None
@@ -35,6 +35,7 @@ class Heartbeat:
 
     def _do_heartbeat(self):
         jobs = self._concurrency.get_jobs()
+        delivering = self._concurrency.get_delivering_jobs()
 
         @backoff.on_exception(
             backoff.expo,
@@ -42,7 +43,7 @@ class Heartbeat:
             max_tries=3,
         )
         def do_send():
-            result = self._session.post(self._heartbeat_url, json={"requestIDs": jobs})
+            result = self._session.post(self._heartbeat_url, json={"requestIDs": jobs, "deliveringRequestIDs": delivering})
             logger.debug(f"heartbeat status: {result.status_code}")
 
         try:
@@ -0,0 +1,94 @@
+"""
+Hooks run around the worker loop, set in the dict passed to start():
+
+    setup: called with env once before the first request, e.g. to load model. For executor "process", it runs in every handler process.
+    warmup: list of requests, or a function of env returning them, run by handler before worker takes any task.
+    teardown: called with env when worker exits. For executor "process", it runs in every handler process instead.
+    gc_freeze: move objects alive after warmup out of garbage collection, so GC passes do not walk the model.
+"""
+
+import gc
+import inspect
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from . import metrics
+from .env import Env
+from .log import logger
+
+WARMUP_SECONDS = metrics.gauge("spirit_warmup_seconds", "Time spent on setup and warmup before taking tasks.")
+
+
+async def call_hook(hook: Any, env: Env):
+    result = hook(env)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def warmup_requests(warmup: Any, env: Env) -> List[Any]:
+    requests = warmup(env) if callable(warmup) else warmup
+    if inspect.isawaitable(requests):
+        requests = await requests
+    result: List[Any] = []
+    for i, request in enumerate(requests or []):
+        if isinstance(request, dict) and "meta" not in request:
+            request = {**request, "meta": {"requestID": f"warmup-{i}", "warmup": True}}
+        result.append(request)
+    return result
+
+
+async def run_setup(handlers: Dict[str, Any], env: Env, in_process: bool = True):
+    """
+    in_process: False if handler runs in other processes, which run setup themselves.
+    """
+    setup = handlers.get("setup")
+    if setup is None or not in_process:
+        return
+    start = time.perf_counter()
+    await call_hook(setup, env)
+    logger.info(f"setup finished in {round((time.perf_counter() - start) * 1000)}ms")
+
+
+async def run_warmup(handlers: Dict[str, Any], env: Env, handler: Callable[[Any], Awaitable[Any]]) -> float:
+    """
+    Run warmup requests one by one, return seconds spent. A failed request is logged and does not stop warmup.
+    """
+    warmup = handlers.get("warmup")
+    if warmup is None:
+        return 0.0
+
+    start = time.perf_counter()
+    requests = await warmup_requests(warmup, env)
+    for i, request in enumerate(requests):
+        request_start = time.perf_counter()
+        try:
+            await handler(request)
+        except Exception as e:
+            logger.error(f"warmup request {i} failed, err: {e}", exc_info=True)
+            continue
+        logger.info(f"warmup request {i} finished in {round((time.perf_counter() - request_start) * 1000)}ms")
+    seconds = time.perf_counter() - start
+    logger.info(f"warmup finished in {round(seconds * 1000)}ms, requests: {len(requests)}")
+    return seconds
+
+
+def freeze_gc(handlers: Dict[str, Any]):
+    if not handlers.get("gc_freeze", False):
+        return
+    gc.collect()
+    gc.freeze()
+    logger.info(f"gc freeze {gc.get_freeze_count()} objects")
+
+
+async def run_teardown(handlers: Dict[str, Any], env: Env, in_process: bool = True):
+    """
+    in_process: False if handler runs in other processes, which run teardown themselves.
+    """
+    teardown: Optional[Any] = handlers.get("teardown")
+    if teardown is None or not in_process:
+        return
+    try:
+        await call_hook(teardown, env)
+    except Exception as e:
+        logger.error(f"teardown failed, err: {e}", exc_info=True)
+    logger.info("teardown finished")
@@ -1,14 +1,29 @@
-import json
+import atexit
 import logging
 import os
+import queue
 import sys
+import threading
 import traceback
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
-from .settings import EASE_LOG_LEVEL
+from . import codec
+from .settings import EASE_LOG_ASYNC, EASE_LOG_DROP_POLICY, EASE_LOG_LEVEL, EASE_LOG_QUEUE_SIZE, EASE_LOG_SAMPLE_RATE
 
 MAX_LOG_LENGTH = 4096
 
+# max number of lines written to stdout at once by async writer
+MAX_WRITE_LINES = 512
+# max seconds a line waits for the queue of async writer under block policy, it is written synchronously after that
+BLOCK_TIMEOUT = 1
+
+# when queue of async writer is full, wait for it
+DROP_POLICY_BLOCK = "block"
+# when queue of async writer is full, drop new lines
+DROP_POLICY_DROP = "drop"
+# when queue of async writer is half full, keep one of every sample rate lines, drop new lines if it is full
+DROP_POLICY_SAMPLE = "sample"
+
 
 _levelToName = {
     logging.CRITICAL: "CRITICAL",
@@ -65,11 +80,168 @@ def _get_log_level():
     return _valid_log_level(level)
 
 
+class _AsyncWriter:
+    """
+    Write log lines to stdout in a background thread, batching queued lines into one write.
+    Lines of ERROR and above are never dropped, they are written synchronously if the queue is full.
+    A forked process does not get the thread, it writes synchronously, see _after_fork.
+    """
+
+    def __init__(self, queue_size: int, policy: str, sample_rate: int):
+        self._queue: queue.Queue[Optional[str]] = queue.Queue(queue_size)
+        self._policy = policy
+        self._sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._sampled = 0
+        self._dropped = 0
+        self._reported = 0
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="spirit-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # the thread is not copied to the child, queued lines would never be written. Lines queued before
+        # fork are written by parent. Handler processes exit without atexit, so a new thread could lose
+        # its last lines as well, write synchronously instead.
+        self._closed = True
+
+    def dropped(self) -> int:
+        return self._dropped
+
+    def write(self, text: str, level: int):
+        if self._closed:
+            self._write_sync(text)
+            return
+
+        if level >= logging.ERROR:
+            # do not wait in event loop, and never lose it
+            try:
+                self._queue.put_nowait(text)
+            except queue.Full:
+                self._write_sync(text)
+            return
+
+        if self._policy == DROP_POLICY_BLOCK:
+            try:
+                self._queue.put(text, timeout=BLOCK_TIMEOUT)
+            except queue.Full:
+                self._write_sync(text)
+            return
+
+        if self._policy == DROP_POLICY_SAMPLE and self._queue.qsize() >= self._queue.maxsize // 2:
+            with self._lock:
+                self._sampled += 1
+                keep = self._sampled % self._sample_rate == 0
+            if not keep:
+                self._drop()
+                return
+
+        try:
+            self._queue.put_nowait(text)
+        except queue.Full:
+            self._drop()
+
+    def _write_sync(self, text: str):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    def _drop(self):
+        with self._lock:
+            self._dropped += 1
+
+    def _run(self):
+        while True:
+            lines: List[str] = []
+            line = self._queue.get()
+            taken = 1
+            done = line is None
+            if line is not None:
+                lines.append(line)
+
+            while not done and taken < MAX_WRITE_LINES:
+                try:
+                    line = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                taken += 1
+                if line is None:
+                    done = True
+                else:
+                    lines.append(line)
+
+            dropped = self._dropped
+            if dropped > self._reported:
+                log = {"message": f"dropped {dropped - self._reported} log lines, total {dropped}", "requestID": "", "level": "WARN"}
+                lines.append(codec.dumps_str(log) + "\n")
+                self._reported = dropped
+
+            try:
+                if len(lines) > 0:
+                    sys.stdout.write("".join(lines))
+                    sys.stdout.flush()
+            except Exception:
+                pass
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+            if done:
+                return
+
+    def flush(self):
+        """
+        Wait until all queued lines are written.
+        """
+        if not self._closed:
+            self._queue.join()
+
+    def close(self, timeout: float = 5):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+def _env_int(key: str, default: int) -> int:
+    value = os.environ.get(key, str(default))
+    try:
+        v = int(value)
+        if v < 1:
+            raise ValueError(f"{key} should be at least 1")
+    except Exception as e:
+        print(f"Invalid {key} {value}: {e}, use default {default}", flush=True)
+        v = default
+    return v
+
+
+def _new_writer() -> Optional[_AsyncWriter]:
+    if os.environ.get(EASE_LOG_ASYNC, "") not in ["True", "true", "1", "yes", "y"]:
+        return None
+
+    policy = os.environ.get(EASE_LOG_DROP_POLICY, DROP_POLICY_SAMPLE)
+    policies = [DROP_POLICY_BLOCK, DROP_POLICY_DROP, DROP_POLICY_SAMPLE]
+    if policy not in policies:
+        print(f"Invalid log drop policy {policy}, use default {DROP_POLICY_SAMPLE}, available policies: {policies}", flush=True)
+        policy = DROP_POLICY_SAMPLE
+    queue_size = _env_int(EASE_LOG_QUEUE_SIZE, 10000)
+    sample_rate = _env_int(EASE_LOG_SAMPLE_RATE, 10)
+    print(f"Async log writer, queue size: {queue_size}, drop policy: {policy}", flush=True)
+    return _AsyncWriter(queue_size, policy, sample_rate)
+
+
 class Logger:
     """Singleton class for logging in spirit-gpu"""
 
     __instance = None
     _level = _get_log_level()
+    _writer = _new_writer()
 
     def __new__(cls):
         if Logger.__instance is None:
@@ -137,14 +309,38 @@ class Logger:
             "requestID": request_id,
             "level": level_name,
         }
-        print(json.dumps(log, ensure_ascii=False), flush=True)
-    
+        text = codec.dumps_str(log) + "\n"
+
         if exc_info:
             exc = sys.exc_info()
-            if exc[0] is None:
-                return # no exception
-            info = "".join(traceback.format_exception(*exc))
-            print(info, end="", flush=True)
+            if exc[0] is not None:
+                text += "".join(traceback.format_exception(*exc))
+
+        if self._writer is not None:
+            self._writer.write(text, level)
+        else:
+            print(text, end="", flush=True)
+
+    def dropped(self) -> int:
+        """
+        Number of log lines dropped by async writer under pressure, see EASE_LOG_DROP_POLICY.
+        """
+        if self._writer is None:
+            return 0
+        return self._writer.dropped()
+
+    def is_async(self) -> bool:
+        """
+        Whether log lines are queued and written by a background thread, see EASE_LOG_ASYNC.
+        """
+        return self._writer is not None
+
+    def flush(self):
+        """
+        Wait until all log lines are written, it is called at exit as well.
+        """
+        if self._writer is not None:
+            self._writer.flush()
 
     def critical(self, message: Any, request_id: Optional[str] = None, caller: bool = False, exc_info: bool = False):
         """
@@ -1,11 +1,21 @@
+import asyncio
+import base64
+from dataclasses import dataclass
 from enum import Enum
-from urllib.parse import urljoin
+from urllib.parse import quote, urljoin
 
 import aiohttp
 
-from . import settings, task
+from . import codec, settings, task
 from .log import logger
-from typing import Any, Callable, Dict
+from .record import new_task_recorder
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# extra seconds given to a long-poll request on top of the wait time asked from agent
+LONG_POLL_GRACE = 5
+
+# larger results are sent on their own instead of in a batch report
+MAX_BATCH_REPORT_RESULT_SIZE = 64 * 1024
 
 
 class ReportType(Enum):
@@ -14,6 +24,14 @@ class ReportType(Enum):
     RESULT = 3
 
 
+@dataclass
+class _Report:
+    type: ReportType
+    request_id: str
+    data: bytes
+    done: "asyncio.Future[None]"
+
+
 class TaskManager:
     async def init(self):
         self._settings = settings.SETTINGS
@@ -30,33 +48,90 @@ class TaskManager:
         self._result_url: Callable[[str], str] = lambda request_id: urljoin(
             self._settings.agent_url(), f"/apis/v1/request-result/{request_id}"
         )
+        self._binary_result_url: Callable[[str], str] = lambda request_id: urljoin(
+            self._settings.agent_url(), f"/apis/v1/request-result-binary/{request_id}"
+        )
+        self._result_chunk_url: Callable[[str], str] = lambda request_id: urljoin(
+            self._settings.agent_url(), f"/apis/v1/request-result-chunk/{request_id}"
+        )
+
+        self._binary_result = self._settings.result_format() == settings.RESULT_FORMAT_BINARY
+        # cleared once agent turns out not to support result chunks
+        self._result_chunk = True
+        self._report_url = urljoin(self._settings.agent_url(), "/apis/v1/request-report")
+
+        self._long_poll = self._settings.fetch_mode() == settings.FETCH_MODE_LONG_POLL
+        self._long_poll_timeout = self._settings.long_poll_timeout()
+        self._recorder = new_task_recorder()
 
-    async def next(self):
-        request, health = await self._get_request()
-        if request is None:
+        # status, result and ack of all requests are buffered for a few milliseconds and sent in one call
+        self._report_delay = self._settings.report_batch_ms()
+        self._reports: List[_Report] = []
+        self._report_wakeup = asyncio.Event()
+        self._report_task: Optional[asyncio.Task[None]] = None
+        if self._report_delay > 0:
+            self._report_task = asyncio.create_task(self._run_reporter())
+
+    def long_poll(self) -> bool:
+        """
+        Whether next() blocks on agent until a task arrives or the long poll timeout passes.
+        """
+        return self._long_poll
+
+    async def next(self) -> Tuple[Optional[task.Task], bool]:
+        tasks, health = await self.next_batch(1)
+        if len(tasks) == 0:
             return None, health
-        return task.Task.parse(request), health
+        return tasks[0], health
+
+    async def next_batch(self, n: int) -> Tuple[List[task.Task], bool]:
+        """
+        Get up to n tasks from agent in one round trip.
+        """
+        requests, health = await self._get_request(n)
+        if self._recorder is not None:
+            self._recorder.record(requests)
+        return [task.Task.parse(request) for request in requests], health
+
+    async def _get_request(self, n: int) -> Tuple[List[Dict[str, Any]], bool]:
+        params: Dict[str, str] = {}
+        timeout = None
+        if n > 1:
+            params["count"] = str(n)
+        if self._long_poll:
+            params["wait"] = str(self._long_poll_timeout * 1000)
+            timeout = aiohttp.ClientTimeout(total=self._long_poll_timeout + LONG_POLL_GRACE)
 
-    async def _get_request(self):
-        async with self._session.get(self._request_url) as resp:
+        async with self._session.get(self._request_url, params=params, timeout=timeout) as resp:
             h = resp.headers.get(settings.HEADER_HEALTH, "true")
             if h == "false":
                 health = False
             else:
                 health = True
 
+            if self._long_poll and resp.headers.get(settings.HEADER_LONG_POLL) != "true":
+                # agent ignores the wait parameter, keep polling instead of spinning on it
+                logger.warn("agent does not support long poll, fall back to polling")
+                self._long_poll = False
+
             if resp.status != 200:
                 if resp.status == 404:
-                    return None, health
+                    return [], health
                 raise Exception(
                     f"failed to get task: {resp.status}, {await resp.text()}"
                 )
-            body: Dict[str, Any] = await resp.json()
-            return body, health
+            body: Dict[str, Any] = codec.loads(await resp.read())
+            # agent without batch support ignores count and returns a single task
+            if "requests" in body:
+                return body["requests"], health
+            return [body], health
 
     async def ack(self, request_id: str):
         # after receive ack, agent will delete request.
         # make sure metric is reported before ack
+        if self._batch_report():
+            await self._add_report(ReportType.ACK, request_id, b"")
+            return
         try:
             await self._ack_request(request_id)
         except Exception as e:
@@ -77,12 +152,69 @@ class TaskManager:
                 return
 
     async def send_result(self, request_id: str, data: bytes):
+        if self._batch_report() and len(data) <= MAX_BATCH_REPORT_RESULT_SIZE:
+            await self._add_report(ReportType.RESULT, request_id, data)
+            return
         try:
             await self._send_result(request_id, data)
         except Exception as e:
             logger.error(f"failed to send result, err: {e}", request_id=request_id, exc_info=True)
 
+    def binary_result(self) -> bool:
+        """
+        Whether results are sent as raw body, with status code and message in headers.
+        """
+        return self._binary_result
+
+    async def send_binary_result(self, request_id: str, status_code: int, message: str, data: task.ResultData) -> bool:
+        """
+        Send result as raw body without copying data.
+        Return False if agent does not support binary result, caller should send it by send_result.
+        """
+        headers = {
+            settings.HEADER_RESULT_STATUS_CODE: str(status_code),
+            settings.HEADER_RESULT_MESSAGE: quote(message),
+            "Content-Type": "application/octet-stream",
+        }
+        try:
+            async with self._session.post(self._binary_result_url(request_id), data=data, headers=headers) as resp:
+                if resp.status in [404, 405]:
+                    logger.warn("agent does not support binary result, send result as json")
+                    self._binary_result = False
+                    return False
+                if resp.status != 200:
+                    text = await resp.text()
+                    logger.error(f"failed to send result, status code: {resp.status}, body: {text}", request_id=request_id)
+        except Exception as e:
+            logger.error(f"failed to send result, err: {e}", request_id=request_id, exc_info=True)
+        return True
+
+    def result_chunk(self) -> bool:
+        """
+        Whether streaming results can be sent chunk by chunk.
+        """
+        return self._result_chunk
+
+    async def send_result_chunk(self, request_id: str, data: bytes) -> bool:
+        """
+        Send one chunk of a streaming result, chunks must be sent in order.
+        Return False if agent does not support result chunks, caller should send the whole result by send_result.
+        Raise exception if agent does not accept it, so the rest of stream can be stopped.
+        """
+        async with self._session.post(self._result_chunk_url(request_id), data=data) as resp:
+            if resp.status in [404, 405]:
+                logger.warn("agent does not support result chunks, send streaming results as a whole")
+                self._result_chunk = False
+                return False
+            if resp.status != 200:
+                text = await resp.text()
+                raise Exception(f"failed to send result chunk, status code: {resp.status}, body: {text}")
+        return True
+
     async def report_status(self, request_id: str, data: bytes):
+        if self._batch_report():
+            await self._add_report(ReportType.STATUS, request_id, data)
+            return
         try:
             await self._report_status(request_id, data)
         except Exception as e:
@@ -95,5 +227,74 @@ class TaskManager:
                 logger.error(f"failed to report status, status code: {resp.status}, body: {text}", request_id=request_id) 
                 return
 
+    def _batch_report(self) -> bool:
+        return self._report_task is not None
+
+    async def _add_report(self, type: ReportType, request_id: str, data: bytes):
+        """
+        Buffer a report and wait until it is sent. Reports are sent in the order they are added,
+        so a status added before ack of the same request reaches agent first.
+        """
+        done = asyncio.get_running_loop().create_future()
+        self._reports.append(_Report(type, request_id, data, done))
+        self._report_wakeup.set()
+        await done
+
+    async def _run_reporter(self):
+        while True:
+            await self._report_wakeup.wait()
+            self._report_wakeup.clear()
+            await asyncio.sleep(self._report_delay / 1000)
+
+            reports, self._reports = self._reports, []
+            try:
+                await self._send_reports(reports)
+            except Exception as e:
+                logger.error(f"failed to send {len(reports)} reports, err: {e}", exc_info=True)
+            finally:
+                for report in reports:
+                    if not report.done.done():
+                        report.done.set_result(None)
+            if not self._batch_report():
+                # fell back to sending reports one by one
+                return
+
+    async def _send_reports(self, reports: List[_Report]):
+        body = {
+            "reports": [
+                {
+                    "type": report.type.name.lower(),
+                    "requestID": report.request_id,
+                    "data": base64.b64encode(report.data).decode("utf-8"),
+                }
+                for report in reports
+            ]
+        }
+        async with self._session.post(self._report_url, data=codec.dumps(body)) as resp:
+            if resp.status == 200:
+                return
+            text = await resp.text()
+            if resp.status not in [404, 405]:
+                logger.error(f"failed to send {len(reports)} reports, status code: {resp.status}, body: {text}")
+                return
+
+        logger.warn("agent does not support batch report, send reports one by one")
+        self._report_task = None
+        # reports added while this batch was sent are left to no reporter, send them too
+        reports, self._reports = reports + self._reports, []
+        for report in reports:
+            if report.type == ReportType.STATUS:
+                await self.report_status(report.request_id, report.data)
+            elif report.type == ReportType.RESULT:
+                await self.send_result(report.request_id, report.data)
+            else:
+                await self.ack(report.request_id)
+            if not report.done.done():
+                report.done.set_result(None)
+
     async def close(self):
+        if self._report_task is not None:
+            self._report_task.cancel()
+        if self._recorder is not None:
+            self._recorder.close()
         await self._session.close()
@@ -0,0 +1,197 @@
+import bisect
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from .log import logger
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+
+    def labels(self, *values: str):
+        """
+        Return the child metric of label values, in the order of labelnames.
+        """
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._new_child()
+            self._children[key] = child
+        return child
+
+    def _new_child(self) -> "_Metric":
+        return self.__class__(self.name, self.help)
+
+    def _samples(self, labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...]) -> List[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        if len(self.labelnames) == 0:
+            lines.extend(self._samples((), ()))
+        else:
+            for values, child in self._children.items():
+                lines.extend(child._samples(self.labelnames, values))
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def _samples(self, labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...]) -> List[str]:
+        return [f"{self.name}{_format_labels(labelnames, labelvalues)} {_format_value(self.value)}"]
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.value = 0.0
+        self._fn: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, fn: Callable[[], float]):
+        """
+        Read the value from fn when metrics are collected.
+        """
+        self._fn = fn
+
+    def _samples(self, labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...]) -> List[str]:
+        value = self.value
+        if self._fn is not None:
+            try:
+                value = float(self._fn())
+            except Exception as e:
+                logger.error(f"failed to get value of metric {self.name}, err: {e}")
+        return [f"{self.name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _samples(self, labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...]) -> List[str]:
+        lines: List[str] = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + [math.inf], self.counts):
+            cumulative += count
+            labels = _format_labels(labelnames, labelvalues, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count{labels} {self.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+FETCH_SECONDS = histogram("spirit_fetch_seconds", "Time to get tasks from agent, including long poll wait.")
+PARSE_SECONDS = histogram("spirit_parse_seconds", "Time to parse request body.")
+QUEUE_WAIT_SECONDS = histogram("spirit_queue_wait_seconds", "Time from request enqueued by agent to execution start.")
+HANDLER_SECONDS = histogram("spirit_handler_seconds", "Time to run handler.")
+WEBHOOK_SECONDS = histogram("spirit_webhook_seconds", "Time to send result to webhook, including retries.")
+AGENT_UPLOAD_SECONDS = histogram("spirit_agent_upload_seconds", "Time to send result to agent.")
+
+SLOTS_OCCUPIED = gauge("spirit_slots_occupied", "Number of running requests.")
+SLOTS_FREE = gauge("spirit_slots_free", "Number of requests can be added under allowed concurrency.")
+
+TTL_DROPS = counter("spirit_ttl_drops_total", "Requests dropped because their TTL expired.")
+HANDLER_ERRORS = counter("spirit_handler_errors_total", "Requests failed by exception of handler.")
+WEBHOOK_RETRIES = counter("spirit_webhook_retries_total", "Retries of sending result to webhook.")
+SINGLE_FLIGHT_WAITS = counter("spirit_single_flight_waits_total", "Requests answered by the result of an identical running request.")
+STARTUP_SECONDS = gauge("spirit_startup_seconds", "Time spent in each phase of worker startup.", ["phase"])
+
+
+async def _handle_metrics(request: web.Request):
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(port: int) -> web.AppRunner:
+    """
+    Serve metrics of Prometheus text format on http://0.0.0.0:<port>/metrics
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logger.info(f"serve metrics on port {port}")
+    return runner
@@ -0,0 +1,137 @@
+import time
+from typing import Any, Callable, Dict, Optional, Union
+
+from . import metrics
+from .log import logger
+
+# weight of the latest execution time in the moving average
+DEFAULT_ALPHA = 0.2
+# executions needed before a bucket is used for prediction
+DEFAULT_MIN_SAMPLES = 3
+# buckets kept at most, requests of new buckets beyond it use the overall average
+MAX_BUCKETS = 1024
+# seconds between two requests run although predicted to exceed their TTL, so a stale average recovers
+DEFAULT_PROBE_INTERVAL = 5.0
+
+PREDICTION_ERROR_SECONDS = metrics.histogram(
+    "spirit_execution_prediction_error_seconds", "Absolute difference between predicted and actual execution time."
+)
+PREDICTED_SHEDS = metrics.counter(
+    "spirit_predicted_sheds_total", "Requests rejected because queue time plus predicted execution time exceeds their TTL."
+)
+PREDICTION_PROBES = metrics.counter(
+    "spirit_prediction_probes_total", "Requests run although predicted to exceed their TTL, to refresh the prediction."
+)
+
+Feature = Union[str, Callable[[Any], Any]]
+
+
+class _Average:
+    def __init__(self):
+        self.value = 0.0
+        self.samples = 0
+        # monotonic time of the last sample
+        self.updated_at = 0.0
+
+    def add(self, seconds: float, alpha: float):
+        if self.samples == 0:
+            self.value = seconds
+        else:
+            self.value += alpha * (seconds - self.value)
+        self.samples += 1
+        self.updated_at = time.monotonic()
+
+
+class ExecutionPredictor:
+    """
+    Exponentially weighted moving average of handler execution time, per bucket of a request feature.
+
+    feature: key of request["input"], or a function of request, whose value picks the bucket,
+        e.g. lambda request: request["input"]["max_tokens"] // 256. Values should be few, each has its own average.
+        If it is None, all requests share one bucket.
+    probe_interval: only requests which run update an average, so once it exceeds TTL nothing would lower it.
+        If an average is not updated for probe_interval seconds, a request rejected by it runs anyway.
+    """
+
+    def __init__(
+        self,
+        feature: Optional[Feature] = None,
+        alpha: float = DEFAULT_ALPHA,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        probe_interval: float = DEFAULT_PROBE_INTERVAL,
+    ):
+        self.feature = feature
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.probe_interval = probe_interval
+        self._overall = _Average()
+        self._buckets: Dict[str, _Average] = {}
+        # monotonic time of the last probe, keyed by bucket, "" for the overall average
+        self._probed_at: Dict[str, float] = {}
+
+    def bucket(self, request: Any) -> str:
+        if self.feature is None:
+            return ""
+        try:
+            if callable(self.feature):
+                value = self.feature(request)
+            else:
+                value = request["input"][self.feature]
+        except Exception as e:
+            logger.error(f"failed to get predict_feature of request, use overall average, err: {e}")
+            return ""
+        return str(value)
+
+    def predict(self, bucket: str) -> Optional[float]:
+        """
+        Predicted execution seconds, the overall average if bucket has too few samples, None if that has too few too.
+        """
+        average = self._buckets.get(bucket)
+        if average is not None and average.samples >= self.min_samples:
+            return average.value
+        if self._overall.samples >= self.min_samples:
+            return self._overall.value
+        return None
+
+    def probe(self, bucket: str) -> bool:
+        """
+        Called when a request is predicted to exceed its TTL, return True if it should run anyway to refresh
+        the average its prediction came from.
+        """
+        average = self._buckets.get(bucket)
+        key = bucket
+        if average is None or average.samples < self.min_samples:
+            key, average = "", self._overall
+        now = time.monotonic()
+        if now - max(average.updated_at, self._probed_at.get(key, 0.0)) < self.probe_interval:
+            return False
+        self._probed_at[key] = now
+        PREDICTION_PROBES.inc()
+        return True
+
+    def observe(self, bucket: str, seconds: float, predicted: Optional[float]):
+        if predicted is not None:
+            PREDICTION_ERROR_SECONDS.observe(abs(seconds - predicted))
+        self._overall.add(seconds, self.alpha)
+        if bucket == "":
+            return
+        average = self._buckets.get(bucket)
+        if average is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                return
+            average = self._buckets[bucket] = _Average()
+        average.add(seconds, self.alpha)
+
+
+def new_execution_predictor(handlers: Dict[str, Any]) -> Optional[ExecutionPredictor]:
+    """
+    Create predictor if handlers["predict_execution"] is set, None otherwise.
+    """
+    if not handlers.get("predict_execution", False):
+        return None
+    feature = handlers.get("predict_feature")
+    if feature is not None and not (callable(feature) or isinstance(feature, str)):
+        logger.error(f"invalid predict_feature {feature}, it should be a key of input or a function, ignore it")
+        feature = None
+    logger.info(f"predict execution time and reject requests which cannot finish within ttl, feature: {feature or 'none'}")
+    return ExecutionPredictor(feature)
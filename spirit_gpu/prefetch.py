@@ -0,0 +1,100 @@
+import asyncio
+import heapq
+import itertools
+from typing import List, Optional, Tuple
+
+from . import metrics
+from .concurrency import Concurrency
+from .log import logger
+from .settings import SETTINGS
+from .task import Task
+
+PREFETCHED = metrics.gauge("spirit_prefetched_tasks", "Tasks fetched ahead and waiting for a free slot.")
+
+
+def deadline(task: Task) -> int:
+    """
+    Unix milliseconds after which the task is dropped.
+    """
+    return task.header.enqueue_at + task.header.ttl
+
+
+class PrefetchBuffer:
+    """
+    Tasks fetched while all slots are busy, so fetching overlaps with running requests.
+
+    Tasks are taken by earliest deadline, not by arrival. The buffer keeps at most `size` tasks
+    more than the free slots. Prefetched tasks are listed in heartbeat, so agent keeps them alive.
+    """
+
+    def __init__(self, concurrency: Concurrency, size: int):
+        self.size = size
+        self._concurrency = concurrency
+        # deadline, arrival order, task
+        self._heap: List[Tuple[int, int, Task]] = []
+        self._counter = itertools.count()
+        self._not_empty = asyncio.Event()
+        self._changed = asyncio.Event()
+        PREFETCHED.set_function(lambda: len(self._heap))
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def space(self) -> int:
+        """
+        Number of tasks to fetch to fill free slots and the buffer.
+        """
+        return max(0, self.size + self._concurrency.free_slots() - len(self._heap))
+
+    def push(self, tasks: List[Task]):
+        for task in tasks:
+            heapq.heappush(self._heap, (deadline(task), next(self._counter), task))
+            self._concurrency.prefetch(task.header.request_id)
+        if len(self._heap) > 0:
+            self._not_empty.set()
+
+    def pop_expired(self, now: int) -> List[Task]:
+        """
+        Remove and return tasks whose deadline has passed.
+        """
+        expired: List[Task] = []
+        while len(self._heap) > 0 and self._heap[0][0] < now:
+            expired.append(self._pop())
+        return expired
+
+    def pop(self) -> Optional[Task]:
+        """
+        Remove and return the task of earliest deadline.
+        """
+        if len(self._heap) == 0:
+            return None
+        return self._pop()
+
+    def _pop(self) -> Task:
+        _, _, task = heapq.heappop(self._heap)
+        if len(self._heap) == 0:
+            self._not_empty.clear()
+        self._changed.set()
+        return task
+
+    async def wait_not_empty(self):
+        await self._not_empty.wait()
+
+    async def wait_taken(self, timeout: float):
+        """
+        Wait until a task is taken from the buffer, at most timeout seconds.
+        """
+        self._changed.clear()
+        timer = asyncio.get_running_loop().call_later(timeout, self._changed.set)
+        try:
+            await self._changed.wait()
+        finally:
+            timer.cancel()
+
+
+def new_prefetch_buffer(concurrency: Concurrency) -> Optional[PrefetchBuffer]:
+    size = SETTINGS.prefetch_size()
+    if size <= 0:
+        return None
+    logger.info(f"prefetch tasks by earliest deadline, size: {size}")
+    return PrefetchBuffer(concurrency, size)
@@ -0,0 +1,357 @@
+import asyncio
+import atexit
+import inspect
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, List, Optional, Tuple
+
+from . import conf, lifecycle
+from .env import Env
+from .log import logger
+
+# seconds given to handler processes to run teardown hook when the pool closes
+TEARDOWN_TIMEOUT = 10
+
+
+class _Close:
+    """
+    Sent to a handler process instead of a request when the pool closes.
+    """
+
+
+def _child_handler(handler: Any, env: Env) -> Callable[[Any], Any]:
+    """
+    Turn user handler to a plain function inside child process, generators are collected to list.
+    """
+    if inspect.isasyncgenfunction(handler):
+        loop = asyncio.new_event_loop()
+
+        async def collect(request: Any):
+            return [r async for r in handler(request, env)]
+
+        return lambda request: loop.run_until_complete(collect(request))
+
+    if inspect.iscoroutinefunction(handler):
+        loop = asyncio.new_event_loop()
+        return lambda request: loop.run_until_complete(handler(request, env))
+
+    if inspect.isgeneratorfunction(handler):
+        return lambda request: list(handler(request, env))
+
+    return lambda request: handler(request, env)
+
+
+def _child_warmup(call: Callable[[Any], Any], requests: List[Any]):
+    start = time.perf_counter()
+    for i, request in enumerate(requests):
+        try:
+            call(request)
+        except Exception as e:
+            logger.error(f"warmup request {i} failed, err: {e}", exc_info=True)
+    logger.info(f"handler process warmup finished in {round((time.perf_counter() - start) * 1000)}ms, requests: {len(requests)}")
+
+
+def _child_teardown(teardown: Any, env: Env):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(lifecycle.call_hook(teardown, env))
+        logger.info("handler process teardown finished")
+    except Exception as e:
+        logger.error(f"handler process teardown failed, err: {e}", exc_info=True)
+    finally:
+        loop.close()
+
+
+def _child_main(conn: Connection, handler: Any, config: conf.Config, setup: Any, warmup: Any, teardown: Any):
+    # forked from a running event loop, forget its state before running our own loop
+    asyncio.events._set_running_loop(None)
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    env = Env(config)
+    try:
+        loop = asyncio.new_event_loop()
+        if setup is not None:
+            loop.run_until_complete(lifecycle.call_hook(setup, env))
+        call = _child_handler(handler, env)
+        if warmup is not None:
+            _child_warmup(call, loop.run_until_complete(lifecycle.warmup_requests(warmup, env)))
+        loop.close()
+    except Exception as e:
+        conn.send((False, f"{type(e).__name__}: {e}"))
+        return
+    # tell parent process it is ready to take requests
+    conn.send((True, None))
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            request = _Close()
+        if isinstance(request, _Close):
+            if teardown is not None:
+                _child_teardown(teardown, env)
+            return
+
+        try:
+            result = call(request)
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+            continue
+
+        try:
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, f"failed to send result of handler to worker process, err: {e}"))
+
+
+def _zygote_main(conn: Connection, handler: Any, config: conf.Config, setup: Any, warmup: Any, teardown: Any):
+    """
+    Fork handler processes on request of the pool. The zygote is started before the worker runs other threads
+    and runs none itself, so a handler process never inherits a lock held by another thread.
+
+    Requests are tuples, answered in order:
+        ("fork",) followed by the child end of a pipe sent by send_handle: pid of the new process.
+        ("status", pid): exit code of the process, None if it is running.
+    """
+    asyncio.events._set_running_loop(None)
+    signal.set_wakeup_fd(-1)
+    # stopped by the pool, or by EOF once the worker exits
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            command = conn.recv()
+        except EOFError:
+            return
+        if command[0] == "fork":
+            fd = reduction.recv_handle(conn)
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    conn.close()
+                    _child_main(Connection(fd), handler, config, setup, warmup, teardown)
+                except BaseException:
+                    traceback.print_exc()
+                    code = 1
+                finally:
+                    os._exit(code)
+            os.close(fd)
+            conn.send(pid)
+        elif command[0] == "status":
+            conn.send(_wait_status(command[1]))
+        else:
+            return
+
+
+def _wait_status(pid: int) -> Optional[int]:
+    """
+    Exit code like multiprocessing, negative signal number if killed, None if process is running.
+    """
+    try:
+        waited, status = os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        # reaped already
+        return 0
+    if waited == 0:
+        return None
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+@dataclass
+class _Child:
+    pid: int
+    conn: Connection
+    # setup and warmup finished
+    ready: bool = False
+
+
+class ProcessPool:
+    """
+    Pool of pre-forked processes running user handler, each process has its own Env.
+    Requests and results are passed through pipes, a crashed process is replaced by a new one.
+    Every process runs setup and warmup hooks before it takes requests, and teardown hook when the pool closes.
+    Processes are forked by a zygote process, see _zygote_main.
+    """
+
+    def __init__(
+        self,
+        handler: Any,
+        config: conf.Config,
+        size: int,
+        setup: Any = None,
+        warmup: Any = None,
+        teardown: Any = None,
+    ):
+        self._handler = handler
+        self._config = config
+        self._size = size
+        self._setup = setup
+        self._warmup = warmup
+        self._teardown = teardown
+        self._ctx = multiprocessing.get_context("fork")
+        # waiting for results blocks, do it out of event loop
+        self._io = ThreadPoolExecutor(max_workers=size, thread_name_prefix="spirit-process-io")
+        self._children: List[_Child] = []
+        self._idle: Optional[asyncio.Queue[_Child]] = None
+        self._zygote: Optional[BaseProcess] = None
+        self._zygote_conn: Optional[Connection] = None
+        # zygote is asked from event loop and from threads reaping processes
+        self._zygote_lock = threading.Lock()
+
+    def size(self) -> int:
+        return self._size
+
+    def start(self):
+        """
+        Fork processes and wait until all of them finish setup and warmup.
+        """
+        start = time.perf_counter()
+        self._idle = asyncio.Queue()
+        conn, zygote_conn = self._ctx.Pipe()
+        self._zygote = self._ctx.Process(
+            target=_zygote_main,
+            args=(zygote_conn, self._handler, self._config, self._setup, self._warmup, self._teardown),
+            name="spirit-handler-zygote",
+        )
+        self._zygote.start()
+        zygote_conn.close()
+        self._zygote_conn = conn
+        atexit.register(self.close)
+        for _ in range(self._size):
+            self._idle.put_nowait(self._fork())
+        for child in self._children:
+            self._wait_ready(child)
+        logger.info(f"run handler in process pool, processes: {self._size}, ready in {round((time.perf_counter() - start) * 1000)}ms")
+
+    def _ask_zygote(self, command: Tuple[Any, ...], fd: Optional[int] = None) -> Any:
+        assert self._zygote_conn is not None, "process pool is not started"
+        with self._zygote_lock:
+            self._zygote_conn.send(command)
+            if fd is not None:
+                assert self._zygote is not None
+                reduction.send_handle(self._zygote_conn, fd, self._zygote.pid)
+            return self._zygote_conn.recv()
+
+    def _wait_ready(self, child: _Child):
+        try:
+            ok, error = child.conn.recv()
+        except (EOFError, OSError) as e:
+            ok, error = False, f"err: {e}"
+        if not ok:
+            raise Exception(f"handler process {child.pid} failed to start, {error}")
+        child.ready = True
+
+    def _fork(self) -> _Child:
+        parent_conn, child_conn = self._ctx.Pipe()
+        pid = self._ask_zygote(("fork",), child_conn.fileno())
+        # only child holds its end, so parent gets EOF once child exits
+        child_conn.close()
+        child = _Child(pid=pid, conn=parent_conn)
+        self._children.append(child)
+        return child
+
+    def _replace(self, child: _Child, error: Optional[str] = None) -> _Child:
+        """
+        Terminate child, it may still be running a request which is given up, and fork a new one.
+        error: why child exited by itself, logged with its exit code.
+        """
+        self._signal(child, signal.SIGTERM)
+        self._children.remove(child)
+        # waiting for exit blocks, do it out of event loop
+        asyncio.get_running_loop().run_in_executor(None, self._reap, child, 1.0, error)
+        return self._fork()
+
+    def _signal(self, child: _Child, sig: int):
+        try:
+            os.kill(child.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self, child: _Child, timeout: float, error: Optional[str] = None) -> int:
+        """
+        Wait until child exits, kill it after timeout seconds. Return its exit code.
+        """
+        deadline = time.monotonic() + timeout
+        killed = False
+        while True:
+            try:
+                code = self._ask_zygote(("status", child.pid))
+            except (EOFError, OSError):
+                # zygote is gone, its children are reaped by init
+                code = None
+                break
+            if code is not None:
+                break
+            if not killed and time.monotonic() >= deadline:
+                self._signal(child, signal.SIGKILL)
+                killed = True
+            time.sleep(0.01)
+        child.conn.close()
+        if error is not None:
+            logger.error(f"handler process {child.pid} exit unexpectedly, exit code: {code}, err: {error}")
+        return code
+
+    async def submit(self, request: Any) -> Any:
+        assert self._idle is not None, "process pool is not started"
+        child = await self._idle.get()
+        loop = asyncio.get_running_loop()
+        try:
+            if not child.ready:
+                # replaced process may still be warming up
+                await loop.run_in_executor(self._io, self._wait_ready, child)
+            child.conn.send(request)
+            ok, result = await loop.run_in_executor(self._io, child.conn.recv)
+        except (EOFError, OSError) as e:
+            self._idle.put_nowait(self._replace(child, str(e) or type(e).__name__))
+            raise Exception(f"handler process {child.pid} exit unexpectedly, a new one is started")
+        except BaseException:
+            # state of pipe is unknown, e.g. request is not picklable or task is cancelled while process runs it
+            self._idle.put_nowait(self._replace(child))
+            raise
+
+        self._idle.put_nowait(child)
+        if not ok:
+            raise Exception(result)
+        return result
+
+    def close(self, timeout: float = TEARDOWN_TIMEOUT):
+        """
+        Ask processes to exit. With teardown hook, they are given timeout seconds to run it before killed.
+        """
+        if self._zygote is None:
+            return
+        for child in self._children:
+            try:
+                child.conn.send(_Close())
+            except (OSError, ValueError):
+                # process has exited, or pipe is closed
+                pass
+        deadline = time.monotonic() + (timeout if self._teardown is not None else 1.0)
+        for child in self._children:
+            self._reap(child, max(0.0, deadline - time.monotonic()))
+        self._children = []
+        assert self._zygote_conn is not None
+        try:
+            with self._zygote_lock:
+                self._zygote_conn.send(("exit",))
+        except (OSError, ValueError):
+            pass
+        self._zygote_conn.close()
+        self._zygote.join(timeout=1)
+        if self._zygote.is_alive():
+            self._zygote.kill()
+        self._zygote = None
+        self._io.shutdown(wait=False)
@@ -0,0 +1,125 @@
+"""
+Record tasks fetched from agent, so production traffic can be replayed later by `python -m spirit_gpu.bench.replay`.
+
+Every task is appended as one line of json:
+
+    {"arrivedAt": <unix milli the worker fetched it>, "headers": {...}, "body": <base64>, "size": <body bytes>}
+
+headers are kept as agent sent them, including enqueue and create timestamps, mode and ttl.
+Files ending with ".gz" are gzip compressed, every worker start appends a new gzip member.
+"""
+
+import atexit
+import base64
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+from . import codec
+from .log import logger
+from .settings import RECORD_REDACT_BODY, RECORD_REDACT_NONE, RECORD_REDACT_STRINGS, SETTINGS
+from .utils import current_unix_milli
+
+
+def _redact_strings(obj: Any) -> Any:
+    if isinstance(obj, str):
+        return "*" * len(obj)
+    if isinstance(obj, list):
+        return [_redact_strings(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: _redact_strings(v) for k, v in obj.items()}
+    return obj
+
+
+def redact(body: bytes, policy: str) -> Optional[bytes]:
+    """
+    Return body redacted by policy, None if body is dropped.
+    """
+    if policy == RECORD_REDACT_BODY:
+        return None
+    if policy == RECORD_REDACT_STRINGS:
+        try:
+            return codec.dumps(_redact_strings(codec.loads(body)))
+        except Exception:
+            # not json, nothing to keep but the size
+            return b"*" * len(body)
+    return body
+
+
+class TaskRecorder:
+    """
+    Append fetched tasks to a file. Writes run in a background thread in fetch order,
+    so recording never blocks the worker loop on disk.
+    """
+
+    def __init__(self, path: str, policy: str = RECORD_REDACT_NONE):
+        self.path = path
+        self.policy = policy
+        self._file: IO[bytes] = gzip.open(path, "ab") if path.endswith(".gz") else open(path, "ab")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-recorder")
+        # gzip trailer is only written on close
+        atexit.register(self.close)
+
+    def record(self, requests: List[Dict[str, Any]]):
+        """
+        requests are tasks as returned by agent: {"headers": {...}, "body": <base64>}
+        """
+        if len(requests) == 0:
+            return
+        self._executor.submit(self._write, current_unix_milli(), requests)
+
+    def _write(self, arrived_at: int, requests: List[Dict[str, Any]]):
+        try:
+            lines: List[bytes] = []
+            for request in requests:
+                body = base64.b64decode(request.get("body", ""))
+                redacted = redact(body, self.policy)
+                record: Dict[str, Any] = {
+                    "arrivedAt": arrived_at,
+                    "headers": request.get("headers", {}),
+                    "size": len(body),
+                }
+                if redacted is not None:
+                    record["body"] = base64.b64encode(redacted).decode("utf-8")
+                lines.append(codec.dumps(record) + b"\n")
+            self._file.write(b"".join(lines))
+            self._file.flush()
+        except Exception as e:
+            logger.error(f"failed to record tasks to {self.path}, err: {e}")
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._executor.shutdown(wait=True)
+        self._file.close()
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield records of a file written by TaskRecorder, in the order they were written.
+    """
+    f: IO[bytes] = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+    with f:
+        try:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                yield codec.loads(line)
+        except EOFError:
+            # gzip member of a worker killed before closing it, keep what is flushed
+            return
+
+
+def new_task_recorder() -> Optional[TaskRecorder]:
+    path = SETTINGS.record_file()
+    if path == "":
+        return None
+    policy = SETTINGS.record_redact()
+    try:
+        recorder = TaskRecorder(path, policy)
+    except Exception as e:
+        logger.error(f"failed to open record file {path}, tasks are not recorded, err: {e}")
+        return None
+    logger.info(f"record tasks to {path}, redact: {policy}")
+    return recorder
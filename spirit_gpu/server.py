@@ -1,40 +1,67 @@
-import asyncio
-import json
 import os
 from typing import Dict, Any
 from aiohttp import web
 
+from . import codec, lifecycle
 from .env import Env
 from .log import logger
 from .settings import EASE_TEST_PORT
-from .worker import wrap_handler
+from .batch import new_batch_scheduler
+from .executor import new_executor, uses_process_pool
+from .worker import build_handler
 
 
 class Handler:
     async def init(self, handlers: Dict[str, Any], env: Env):
-        self.handler = await wrap_handler(handlers["handler"], env)
+        """
+        Run in the loop of the app, batch scheduler and process pool are bound to it.
+        """
+        executor = new_executor(handlers)
+        batch_scheduler = new_batch_scheduler(handlers, env, executor)
+        if batch_scheduler is not None:
+            self.handler = batch_scheduler.submit
+        else:
+            self.handler, _ = await build_handler(handlers, env, executor)
         self.env = env
 
+        in_process = not uses_process_pool(handlers)
+        await lifecycle.run_setup(handlers, env, in_process)
+        if in_process:
+            await lifecycle.run_warmup(handlers, env, self.handler)
+        lifecycle.freeze_gc(handlers)
+        self.handlers = handlers
+        self.in_process = in_process
+
+    async def close(self):
+        await lifecycle.run_teardown(self.handlers, self.env, self.in_process)
+
     async def handle_post(self, request: web.Request):
         body = await request.read()
         try:
-            data = json.loads(body)
+            data = codec.loads(body)
         except Exception as e:
             logger.error(f"failed to parse request data: {e}")
             raise web.HTTPBadRequest()
 
         res = await self.handler(data)
-        if type(res) == bytes:
+        if isinstance(res, (bytes, bytearray, memoryview)):
             return web.Response(body=res)
         else:
-            return web.json_response(res)
+            return web.Response(body=codec.dumps(res), content_type="application/json")
 
 
 def run(handlers: Dict[str, Any], env: Env):
     handler = Handler()
-    asyncio.run(handler.init(handlers, env))
+
+    async def on_startup(_: web.Application):
+        await handler.init(handlers, env)
+
+    async def on_cleanup(_: web.Application):
+        await handler.close()
 
     app = web.Application()
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
     app.router.add_post("/", handler.handle_post)
     port = int(os.environ.get(EASE_TEST_PORT, 8080))
     web.run_app(app, port=port)  # pyright: ignore
@@ -2,11 +2,45 @@ import os
 
 EASE_TEST_MODE = "EASE_TEST_MODE"
 EASE_LOG_LEVEL = "EASE_LOG_LEVEL"
+EASE_LOG_ASYNC = "EASE_LOG_ASYNC"
+EASE_LOG_QUEUE_SIZE = "EASE_LOG_QUEUE_SIZE"
+EASE_LOG_DROP_POLICY = "EASE_LOG_DROP_POLICY"
+EASE_LOG_SAMPLE_RATE = "EASE_LOG_SAMPLE_RATE"
 EASE_TEST_PORT = "EASE_TEST_PORT"
 EASE_AGENT_URL = "EASE_AGENT_URL"
 EASE_HEARTBEAT_INTERVAL = "EASE_HEARTBEAT_INTERVAL"
+EASE_FETCH_MODE = "EASE_FETCH_MODE"
+EASE_LONG_POLL_TIMEOUT = "EASE_LONG_POLL_TIMEOUT"
+EASE_REPORT_BATCH_MS = "EASE_REPORT_BATCH_MS"
+EASE_DELIVERY_CONCURRENCY = "EASE_DELIVERY_CONCURRENCY"
+EASE_RESULT_FORMAT = "EASE_RESULT_FORMAT"
+EASE_RESULT_STORE = "EASE_RESULT_STORE"
+EASE_LARGE_RESULT_THRESHOLD = "EASE_LARGE_RESULT_THRESHOLD"
+EASE_DELIVERY_QUEUE_SIZE = "EASE_DELIVERY_QUEUE_SIZE"
+EASE_METRICS_PORT = "EASE_METRICS_PORT"
+EASE_RECORD_FILE = "EASE_RECORD_FILE"
+EASE_RECORD_REDACT = "EASE_RECORD_REDACT"
+EASE_DOWNLOAD_CACHE_DIR = "EASE_DOWNLOAD_CACHE_DIR"
+EASE_DOWNLOAD_CACHE_BYTES = "EASE_DOWNLOAD_CACHE_BYTES"
+EASE_CONCURRENCY_INTERVAL_MS = "EASE_CONCURRENCY_INTERVAL_MS"
+EASE_PREFETCH_SIZE = "EASE_PREFETCH_SIZE"
 
 HEADER_HEALTH = "X-Agent-Health"
+HEADER_LONG_POLL = "X-Agent-Long-Poll"
+HEADER_RESULT_STATUS_CODE = "X-Result-Status-Code"
+HEADER_RESULT_MESSAGE = "X-Result-Message"
+
+FETCH_MODE_POLL = "poll"
+FETCH_MODE_LONG_POLL = "long-poll"
+
+RESULT_FORMAT_JSON = "json"
+RESULT_FORMAT_BINARY = "binary"
+
+RECORD_REDACT_NONE = "none"
+# replace every string of a json body with the same number of "*", keeping its shape and size
+RECORD_REDACT_STRINGS = "strings"
+# drop body, only its size is kept
+RECORD_REDACT_BODY = "body"
 
 
 class _Settings:
@@ -28,5 +62,121 @@ class _Settings:
             hbi = 5
         return hbi
 
+    def fetch_mode(self) -> str:
+        mode = os.environ.get(EASE_FETCH_MODE, FETCH_MODE_POLL)
+        if mode not in [FETCH_MODE_POLL, FETCH_MODE_LONG_POLL]:
+            print(f"invalid fetch mode {mode}, use default {FETCH_MODE_POLL}")
+            mode = FETCH_MODE_POLL
+        return mode
+
+    def long_poll_timeout(self) -> int:
+        timeout = os.environ.get(EASE_LONG_POLL_TIMEOUT, "20")
+        try:
+            t = int(timeout)
+        except Exception as e:
+            print(f"failed to get long poll timeout: {e}, use default 20")
+            t = 20
+        return t
+
+    def result_format(self) -> str:
+        format = os.environ.get(EASE_RESULT_FORMAT, RESULT_FORMAT_JSON)
+        if format not in [RESULT_FORMAT_JSON, RESULT_FORMAT_BINARY]:
+            print(f"invalid result format {format}, use default {RESULT_FORMAT_JSON}")
+            format = RESULT_FORMAT_JSON
+        return format
+
+    def result_store(self) -> str:
+        return os.environ.get(EASE_RESULT_STORE, "")
+
+    def large_result_threshold(self) -> int:
+        threshold = os.environ.get(EASE_LARGE_RESULT_THRESHOLD, str(10 * 1024 * 1024))
+        try:
+            t = int(threshold)
+        except Exception as e:
+            print(f"failed to get large result threshold: {e}, use default 10MB")
+            t = 10 * 1024 * 1024
+        return t
+
+    def report_batch_ms(self) -> int:
+        delay = os.environ.get(EASE_REPORT_BATCH_MS, "0")
+        try:
+            d = int(delay)
+        except Exception as e:
+            print(f"failed to get report batch milliseconds: {e}, use default 0")
+            d = 0
+        return d
+
+    def delivery_concurrency(self) -> int:
+        c = os.environ.get(EASE_DELIVERY_CONCURRENCY, "0")
+        try:
+            dc = int(c)
+        except Exception as e:
+            print(f"failed to get delivery concurrency: {e}, use default 0")
+            dc = 0
+        return dc
+
+    def delivery_queue_size(self) -> int:
+        size = os.environ.get(EASE_DELIVERY_QUEUE_SIZE, "64")
+        try:
+            qs = int(size)
+            if qs < 1:
+                raise ValueError("delivery queue size should be at least 1")
+        except Exception as e:
+            print(f"failed to get delivery queue size: {e}, use default 64")
+            qs = 64
+        return qs
+
+    def concurrency_interval_ms(self) -> int:
+        interval = os.environ.get(EASE_CONCURRENCY_INTERVAL_MS, "1000")
+        try:
+            i = int(interval)
+            if i < 1:
+                raise ValueError("concurrency interval should be at least 1 millisecond")
+        except Exception as e:
+            print(f"failed to get concurrency interval milliseconds: {e}, use default 1000")
+            i = 1000
+        return i
+
+    def prefetch_size(self) -> int:
+        size = os.environ.get(EASE_PREFETCH_SIZE, "0")
+        try:
+            ps = int(size)
+        except Exception as e:
+            print(f"failed to get prefetch size: {e}, use default 0")
+            ps = 0
+        return ps
+
+    def metrics_port(self) -> int:
+        port = os.environ.get(EASE_METRICS_PORT, "0")
+        try:
+            p = int(port)
+        except Exception as e:
+            print(f"failed to get metrics port: {e}, use default 0")
+            p = 0
+        return p
+
+    def record_file(self) -> str:
+        return os.environ.get(EASE_RECORD_FILE, "")
+
+    def record_redact(self) -> str:
+        policy = os.environ.get(EASE_RECORD_REDACT, RECORD_REDACT_NONE)
+        if policy not in [RECORD_REDACT_NONE, RECORD_REDACT_STRINGS, RECORD_REDACT_BODY]:
+            print(f"unknown record redact policy {policy}, use default {RECORD_REDACT_NONE}")
+            return RECORD_REDACT_NONE
+        return policy
+
+    def download_cache_dir(self) -> str:
+        return os.environ.get(EASE_DOWNLOAD_CACHE_DIR, "")
+
+    def download_cache_bytes(self) -> int:
+        default = 20 * 1024 * 1024 * 1024
+        size = os.environ.get(EASE_DOWNLOAD_CACHE_BYTES, str(default))
+        try:
+            b = int(size)
+        except Exception as e:
+            print(f"failed to get download cache bytes: {e}, use default {default}")
+            b = default
+        return b
+
 
 SETTINGS = _Settings()
@@ -0,0 +1,46 @@
+"""
+Time spent in each phase of worker startup, logged once when worker gets the result of its first poll.
+Only the standard library is imported here, it is the first module imported by spirit_gpu.
+"""
+
+import time
+from typing import List, Tuple
+
+_phases: List[Tuple[str, float]] = []
+_last = time.perf_counter()
+_reported = False
+
+
+def mark(phase: str):
+    """
+    Record the time since the previous mark, or since spirit_gpu started importing, as phase.
+    """
+    global _last
+    now = time.perf_counter()
+    _phases.append((phase, now - _last))
+    _last = now
+
+
+def timings() -> List[Tuple[str, float]]:
+    """
+    Phases and their seconds, in the order they were marked.
+    """
+    return list(_phases)
+
+
+def reported() -> bool:
+    return _reported
+
+
+def report():
+    """
+    Log phases marked so far.
+    """
+    global _reported
+    _reported = True
+
+    from .log import logger
+
+    total = sum(seconds for _, seconds in _phases)
+    phases = ", ".join(f"{phase}: {round(seconds * 1000)}ms" for phase, seconds in _phases)
+    logger.info(f"startup timing, {phases}, total: {round(total * 1000)}ms")
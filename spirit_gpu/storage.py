@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from typing import Any, Dict, Optional
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+
+from .log import logger
+from .task import ResultData
+
+
+def result_size(data: ResultData) -> int:
+    if isinstance(data, memoryview):
+        return data.nbytes
+    return len(data)
+
+
+def _sha256(data: ResultData) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultStore:
+    """
+    Store for results too large to be sent inline, webhook and agent only receive a reference to it.
+    Results are keyed by sha256 of their content, so the same result is stored once.
+    """
+
+    async def put(self, data: ResultData) -> Dict[str, Any]:
+        """
+        Store data and return its reference: {"url": ..., "sha256": ..., "size": ...}
+        """
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, _sha256, data)
+        url = await self._put(digest, data)
+        return {"url": url, "sha256": digest, "size": result_size(data)}
+
+    async def _put(self, key: str, data: ResultData) -> str:
+        raise NotImplementedError()
+
+
+class LocalStore(ResultStore):
+    """
+    Store results in a local directory, e.g. a volume shared with the consumer of results.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _write(self, key: str, data: ResultData) -> str:
+        path = os.path.join(self.directory, key)
+        if os.path.exists(path):
+            return path
+        # write to temporary file first, so readers never see a partial result
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".{key}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # mkstemp creates file readable only by owner, results are read by other processes
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return path
+
+    async def _put(self, key: str, data: ResultData) -> str:
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(None, self._write, key, data)
+        return f"file://{path}"
+
+
+class HTTPStore(ResultStore):
+    """
+    Store results by HTTP PUT to <base_url>/<sha256>, e.g. a bucket of S3 compatible object storage.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _put(self, key: str, data: ResultData) -> str:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        url = urljoin(self.base_url, key)
+        async with self._session.put(url, data=data, headers={"Content-Type": "application/octet-stream"}) as resp:
+            if resp.status not in [200, 201, 204]:
+                text = await resp.text()
+                raise Exception(f"failed to put result to {url}, status code: {resp.status}, body: {text}")
+        return url
+
+
+def new_result_store(url: str) -> Optional[ResultStore]:
+    """
+    url: "file:///path/to/dir" or a plain path for LocalStore, "http(s)://host/bucket" for HTTPStore, empty for no store.
+    """
+    if url == "":
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme in ["http", "https"]:
+        logger.info(f"store large results to {url}")
+        return HTTPStore(url)
+    if parsed.scheme in ["", "file"]:
+        logger.info(f"store large results to directory {parsed.path}")
+        return LocalStore(parsed.path)
+    logger.error(f"unsupported result store {url}, send large results inline")
+    return None
@@ -0,0 +1,169 @@
+import asyncio
+import base64
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from . import codec
+from .log import logger
+from .manager import TaskManager
+from .task import MsgHeader
+
+# chunks buffered for agent or webhook before handler is paused
+MAX_PENDING_CHUNKS = 64
+
+
+def encode_chunk(item: Any) -> bytes:
+    """
+    bytes are sent as they are, other items are sent as one line of json.
+    """
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return bytes(item)
+    return codec.dumps(item) + b"\n"
+
+
+def get_chunk(index: int, final: bool, status_code: int, message: str, data: bytes) -> Dict[str, Any]:
+    return {
+        "index": index,
+        "final": final,
+        "statusCode": status_code,
+        "message": message,
+        "data": base64.b64encode(data).decode("utf-8"),
+    }
+
+
+class _StreamFailed(Exception):
+    pass
+
+
+class ResultStream:
+    """
+    Forward chunks of a generator handler to agent and webhook while handler is running.
+
+    Agent receives every chunk in order, the last one is marked final and carries the status code.
+    Webhook receives one POST with chunked transfer encoding. If handler fails, an error line is
+    written and the transfer is aborted, so webhook never sees a complete body of a failed request.
+    If agent does not support result chunks, items for agent are collected instead, see collected().
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, task_manager: TaskManager, header: MsgHeader, webhook: str):
+        self._session = session
+        self._task_manager = task_manager
+        self._header = header
+        self._webhook = webhook
+        # items for agent which does not support result chunks, None if they are sent one by one
+        self._collected: Optional[List[Any]] = None if task_manager.result_chunk() else []
+
+        # item, its chunk, final, status code, message
+        self._agent_queue: asyncio.Queue[Optional[Tuple[Any, bytes, bool, int, str]]] = asyncio.Queue(MAX_PENDING_CHUNKS)
+        self._agent_task = asyncio.create_task(self._send_to_agent())
+
+        self._webhook_queue: asyncio.Queue[Any] = asyncio.Queue(MAX_PENDING_CHUNKS)
+        self._webhook_task: Optional[asyncio.Task[Optional[str]]] = None
+        if webhook != "":
+            self._webhook_task = asyncio.create_task(self._send_to_webhook())
+
+    async def send(self, item: Any):
+        """
+        Send an item yielded by handler.
+        """
+        chunk = encode_chunk(item)
+        await self._put(self._agent_queue, self._agent_task, (item, chunk, False, 200, ""))
+        if self._webhook_task is not None:
+            await self._put(self._webhook_queue, self._webhook_task, chunk)
+
+    async def finish(self) -> Optional[str]:
+        """
+        Send completion marker, return error if result is not delivered.
+        """
+        return await self._close(200, "", None)
+
+    async def fail(self, error: str) -> Optional[str]:
+        return await self._close(500, error, error)
+
+    async def _close(self, status_code: int, message: str, error: Optional[str]) -> Optional[str]:
+        await self._put(self._agent_queue, self._agent_task, (None, b"", True, status_code, message))
+        await self._put(self._agent_queue, self._agent_task, None)
+
+        err = None
+        if self._webhook_task is not None:
+            if error is not None:
+                await self._put(self._webhook_queue, self._webhook_task, codec.dumps({"error": error}) + b"\n")
+                await self._put(self._webhook_queue, self._webhook_task, _StreamFailed(error))
+            else:
+                await self._put(self._webhook_queue, self._webhook_task, None)
+            err = await self._webhook_task
+
+        agent_err = await self._agent_task
+        if agent_err is not None:
+            err = f"{err}, {agent_err}" if err is not None else agent_err
+        return err
+
+    def collected(self) -> Optional[List[Any]]:
+        """
+        All items if agent does not support result chunks, caller should send them as the result once stream
+        finishes, like the result of a generator handler without stream. None if chunks are sent to agent.
+        """
+        return self._collected
+
+    async def _put(self, queue: "asyncio.Queue[Any]", consumer: "asyncio.Task[Optional[str]]", item: Any):
+        # consumer may stop early on error, do not wait for it forever
+        if consumer.done():
+            return
+        put = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait([put, consumer], return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+
+    async def _send_to_agent(self) -> Optional[str]:
+        request_id = self._header.request_id
+        index = 0
+        while True:
+            item = await self._agent_queue.get()
+            if item is None:
+                return None
+            value, data, final, status_code, message = item
+            if self._collected is not None:
+                if not final:
+                    self._collected.append(value)
+                continue
+            try:
+                sent = await self._task_manager.send_result_chunk(
+                    request_id, codec.dumps(get_chunk(index, final, status_code, message, data))
+                )
+            except Exception as e:
+                logger.error(f"failed to send result chunk to agent, err: {e}", request_id=request_id, exc_info=True)
+                return f"failed to send result chunk to agent: {e}"
+            if not sent:
+                if index > 0:
+                    return "agent stopped accepting result chunks during stream"
+                self._collected = [] if final else [value]
+            index += 1
+
+    async def _body(self) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await self._webhook_queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, _StreamFailed):
+                raise chunk
+            yield chunk
+
+    async def _send_to_webhook(self) -> Optional[str]:
+        try:
+            async with self._session.post(
+                self._webhook,
+                params={"requestID": self._header.request_id, "statusCode": "200", "stream": "true"},
+                data=self._body(),
+                headers={"Content-Type": "application/x-ndjson"},
+            ) as resp:
+                text = await resp.text()
+                if resp.status != 200:
+                    return f"request {self._header.request_id} receive unsuccess status code {resp.status} from webhook, body: {text}"
+        except _StreamFailed:
+            return None
+        except Exception as e:
+            if isinstance(e.__cause__, _StreamFailed) or isinstance(e.__context__, _StreamFailed):
+                return None
+            return f"failed to call webhook <{self._webhook}>: {str(e)}"
+        return None
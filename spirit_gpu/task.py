@@ -1,7 +1,10 @@
 import base64
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Dict, Union
+
+# result of handler passed to webhook and agent without copying
+ResultData = Union[bytes, bytearray, memoryview]
 
 
 class Status(Enum):
@@ -1,9 +1,38 @@
+import importlib
+import os
 import time
 import subprocess
+from typing import Any
 from spirit_gpu.settings import EASE_TEST_MODE
 
 from .validate import *
-from .file import *
+
+# imported on first use, they need aiohttp which is slow to import
+_LAZY_NAMES = {
+    "download_file": ".file",
+    "download_file_from_url": ".file",
+    "run_sync": ".file",
+    "ChecksumError": ".file",
+    "ProgressCallback": ".file",
+    "DEFAULT_CONNECTIONS": ".file",
+    "DEFAULT_PART_SIZE": ".file",
+}
+
+# star import resolves lazy names through __getattr__, only then .file is imported
+__all__ = [
+    "Schema",
+    "validate_and_set_default",
+    "current_unix_milli",
+    "is_cuda_available",
+    "is_test_mode",
+    *_LAZY_NAMES,
+]
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_NAMES:
+        return getattr(importlib.import_module(_LAZY_NAMES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def current_unix_milli():
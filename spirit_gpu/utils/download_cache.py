@@ -0,0 +1,244 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+
+from spirit_gpu.settings import SETTINGS
+from .file import DEFAULT_CONNECTIONS, ProgressCallback, download_file, run_sync
+
+DEFAULT_CACHE_BYTES = 20 * 1024 * 1024 * 1024
+
+_PARTIAL_SUFFIXES = (".part", ".part.json")
+
+
+def _is_partial(name: str) -> bool:
+    """
+    Files of a download in progress: data, its state, and temporary state files named <name>.part.json.<random>.tmp.
+    """
+    return name.endswith(_PARTIAL_SUFFIXES) or (name.endswith(".tmp") and ".part.json." in name)
+
+
+class _Lock:
+    """
+    Exclusive lock between processes by flock on a lock file, acquired in a thread to keep event loop running.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def _acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def try_acquire(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        acquire = loop.run_in_executor(None, self._acquire)
+        try:
+            await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # the thread still gets the lock, release it then
+            acquire.add_done_callback(lambda _: self.release())
+            raise
+        return self
+
+    async def __aexit__(self, *args: Any):
+        self.release()
+
+
+class DownloadCache:
+    """
+    Files downloaded from urls, kept in a directory shared by tasks and processes.
+
+    A file is keyed by its sha256 if it is given, otherwise by url and the ETag (or Last-Modified and size)
+    returned by server, so a changed remote file is downloaded again.
+    When the directory exceeds max_bytes, least recently used files are removed. Processes having a removed
+    file open can still read it, but paths returned by get() should be opened soon.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock_dir = os.path.join(directory, ".locks")
+        os.makedirs(self._lock_dir, exist_ok=True)
+
+        # (event loop, key) -> download running in this process, get_sync may run in loops of other threads
+        self._in_flight: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Future[str]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        hits and misses of this process, shared counts requests joining a download already running in it.
+        bytes and files are of the whole directory.
+        """
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "evictions": self.evictions,
+            "files": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "maxBytes": self.max_bytes,
+        }
+
+    async def get(
+        self,
+        url: str,
+        *,
+        sha256: Optional[str] = None,
+        connections: int = DEFAULT_CONNECTIONS,
+        progress: Optional[ProgressCallback] = None,
+    ) -> str:
+        """
+        Return path of the cached file of url, download it if it is not cached.
+        """
+        if sha256 is not None:
+            key = f"sha256-{sha256.lower()}"
+        else:
+            key = await self._versioned_key(url)
+
+        loop = asyncio.get_running_loop()
+        future = self._in_flight.get((loop, key))
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        self._in_flight[(loop, key)] = future
+        try:
+            path = await self._get(key, url, sha256, connections, progress)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            # waiters see the exception, do not warn about it never being retrieved
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[(loop, key)]
+
+    async def _versioned_key(self, url: str) -> str:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, headers={"Range": "bytes=0-0"}) as resp:
+                if resp.status != 416:
+                    resp.raise_for_status()
+                version = resp.headers.get("ETag", "")
+                if version == "":
+                    size = resp.headers.get("Content-Range", "").rsplit("/", 1)[-1] or resp.headers.get("Content-Length", "")
+                    version = f"{resp.headers.get('Last-Modified', '')}/{size}"
+        return hashlib.sha256(f"{url}\x00{version}".encode()).hexdigest()
+
+    async def _get(
+        self, key: str, url: str, sha256: Optional[str], connections: int, progress: Optional[ProgressCallback]
+    ) -> str:
+        path = os.path.join(self.directory, key + os.path.splitext(urlparse(url).path)[1])
+        async with _Lock(os.path.join(self._lock_dir, key + ".lock")):
+            if os.path.exists(path):
+                self.hits += 1
+                # mark as recently used
+                os.utime(path)
+                return path
+            self.misses += 1
+            await download_file(url, path, connections=connections, sha256=sha256, progress=progress)
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._evict, path)
+        return path
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries: List[Tuple[float, int, str]] = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith(".") or _is_partial(entry.name) or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self, keep: str):
+        """
+        Remove least recently used files until directory fits in max_bytes. Files being downloaded are skipped.
+        """
+        lock = _Lock(os.path.join(self._lock_dir, ".evict.lock"))
+        if not lock.try_acquire():
+            # another process is evicting
+            return
+        try:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                # keys have no dot, the rest is extension of url
+                key = os.path.basename(path).split(".")[0]
+                entry_lock = _Lock(os.path.join(self._lock_dir, key + ".lock"))
+                if not entry_lock.try_acquire():
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+                finally:
+                    entry_lock.release()
+        finally:
+            lock.release()
+
+    def get_sync(self, url: str, **kwargs: Any) -> str:
+        """
+        Blocking version of get.
+        """
+        return run_sync(self.get(url, **kwargs))
+
+
+_default_cache: Optional[DownloadCache] = None
+
+
+def default_download_cache() -> Optional[DownloadCache]:
+    """
+    Cache of EASE_DOWNLOAD_CACHE_DIR, None if it is not set.
+    """
+    global _default_cache
+    directory = SETTINGS.download_cache_dir()
+    if directory == "":
+        return None
+    if _default_cache is None or _default_cache.directory != directory:
+        _default_cache = DownloadCache(directory, SETTINGS.download_cache_bytes())
+    return _default_cache
@@ -1,31 +1,324 @@
+import asyncio
+import hashlib
+import json
 import os
 import tempfile
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from urllib.parse import urlparse
+import aiohttp
 import backoff
-import requests
 from email import message_from_string
 
+DEFAULT_CONNECTIONS = 4
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
-@backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=3)
-def download_file_from_url(url: str) -> str:
+# downloaded bytes, total bytes (0 if unknown)
+ProgressCallback = Callable[[int, int], Any]
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def _file_extension(url: str, headers: Any) -> str:
+    file_extension = ""
+
+    content_disposition = headers.get("Content-Disposition", "")
+    if content_disposition != "":
+        msg = message_from_string(f"Content-Disposition: {content_disposition}")
+        file_extension = os.path.splitext(msg.get_filename() or "")[1]
+
+    if not file_extension:
+        file_extension = os.path.splitext(urlparse(url).path)[1]
+    return file_extension
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _Download:
+    """
+    Download url to path by parallel range requests.
+
+    Data is written to <path>.part, finished parts are recorded in <path>.part.json.
+    If both exist and the remote file has the same size and ETag, only missing parts are downloaded again.
+    If path is None, a new file in temporary directory is used, named after the extension of the remote file.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        path: Optional[str],
+        connections: int,
+        part_size: int,
+        progress: Optional[ProgressCallback],
+    ):
+        self.session = session
+        self.url = url
+        self.path = path or ""
+        self.connections = max(1, connections)
+        self.part_size = max(DOWNLOAD_CHUNK_SIZE, part_size)
+        self.progress = progress
+
+        self.size = 0
+        self.etag = ""
+        self.downloaded = 0
+        # start offsets of finished parts
+        self.done: List[int] = []
+        # part workers finish concurrently, state is written by one at a time
+        self._state_lock: Optional[asyncio.Lock] = None
+
+    def _report(self, n: int):
+        self.downloaded += n
+        if self.progress is not None:
+            self.progress(self.downloaded, self.size)
+
+    @property
+    def part_path(self) -> str:
+        return self.path + ".part"
+
+    @property
+    def state_path(self) -> str:
+        return self.path + ".part.json"
+
+    async def run(self) -> str:
+        self.downloaded = 0
+        # ask for the first byte instead of HEAD, presigned urls are often only valid for GET
+        async with self.session.get(self.url, headers={"Range": "bytes=0-0"}) as resp:
+            if resp.status == 416:
+                # empty file has no first byte
+                resp.release()
+                async with self.session.get(self.url) as resp:
+                    resp.raise_for_status()
+                    return await self._download_stream(resp)
+            resp.raise_for_status()
+            self._ensure_path(resp)
+            content_range = resp.headers.get("Content-Range", "")
+            if resp.status != 206 or "/" not in content_range or content_range.endswith("/*"):
+                # server does not support ranges, download it in one stream
+                return await self._download_stream(resp)
+            self.size = int(content_range.rsplit("/", 1)[1])
+            self.etag = resp.headers.get("ETag", "")
+
+        loop = asyncio.get_running_loop()
+        self._state_lock = asyncio.Lock()
+        await loop.run_in_executor(None, self._prepare)
+        parts = [start for start in range(0, self.size, self.part_size) if start not in self.done]
+        self._report(self.size - sum(min(self.part_size, self.size - start) for start in parts))
+
+        fd = os.open(self.part_path, os.O_WRONLY)
+        try:
+            queue: asyncio.Queue[int] = asyncio.Queue()
+            for start in parts:
+                queue.put_nowait(start)
+            workers = [asyncio.create_task(self._work(queue, fd)) for _ in range(min(self.connections, len(parts)))]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for w in workers:
+                    w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+        finally:
+            os.close(fd)
+
+        os.replace(self.part_path, self.path)
+        _remove(self.state_path)
+        return self.path
+
+    def _prepare(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if (
+                state["url"] == self.url
+                and state["size"] == self.size
+                and state["etag"] == self.etag
+                and state["partSize"] == self.part_size
+                and os.path.getsize(self.part_path) == self.size
+            ):
+                self.done = list(state["done"])
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+
+        self.done = []
+        with open(self.part_path, "wb") as f:
+            f.truncate(self.size)
+        self._save_state([])
+
+    def _save_state(self, done: List[int]):
+        state = {"url": self.url, "size": self.size, "etag": self.etag, "partSize": self.part_size, "done": done}
+        # unique name, a stale tmp file of an interrupted save never collides with this one
+        fd, tmp = tempfile.mkstemp(
+            prefix=os.path.basename(self.state_path) + ".", suffix=".tmp", dir=os.path.dirname(self.state_path) or None
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+        except BaseException:
+            _remove(tmp)
+            raise
+
+    async def _work(self, queue: "asyncio.Queue[int]", fd: int):
+        loop = asyncio.get_running_loop()
+        while not queue.empty():
+            start = queue.get_nowait()
+            await self._download_part(fd, start)
+            assert self._state_lock is not None
+            async with self._state_lock:
+                self.done.append(start)
+                # snapshot, the list is changed by other workers while it is written in executor
+                await loop.run_in_executor(None, self._save_state, list(self.done))
+
+    async def _download_part(self, fd: int, start: int):
+        end = min(start + self.part_size, self.size) - 1
+        written = 0
+
+        @backoff.on_exception(backoff.expo, (aiohttp.ClientError, asyncio.TimeoutError), max_tries=3)
+        async def do_download():
+            nonlocal written
+            # continue after the bytes written by the failed try
+            headers = {"Range": f"bytes={start + written}-{end}"}
+            if self.etag != "":
+                headers["If-Range"] = self.etag
+            async with self.session.get(self.url, headers=headers) as resp:
+                resp.raise_for_status()
+                if resp.status != 206:
+                    # If-Range does not match, retrying the part would not help
+                    raise Exception(f"{self.url} changed during download, got status {resp.status} for range request")
+                loop = asyncio.get_running_loop()
+                async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    await loop.run_in_executor(None, os.pwrite, fd, chunk, start + written)
+                    written += len(chunk)
+                    self._report(len(chunk))
+
+        await do_download()
+        if written != end - start + 1:
+            raise aiohttp.ClientPayloadError(f"part {start}-{end} of {self.url} is incomplete, got {written} bytes")
+
+    def _ensure_path(self, resp: aiohttp.ClientResponse):
+        if self.path == "":
+            fd, self.path = tempfile.mkstemp(suffix=_file_extension(self.url, resp.headers))
+            os.close(fd)
+
+    async def _download_stream(self, resp: aiohttp.ClientResponse) -> str:
+        self._ensure_path(resp)
+        self.size = int(resp.headers.get("Content-Length", "0"))
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(None, open, self.part_path, "wb")
+        try:
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                await loop.run_in_executor(None, f.write, chunk)
+                self._report(len(chunk))
+        finally:
+            f.close()
+        os.replace(self.part_path, self.path)
+        _remove(self.state_path)
+        return self.path
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def download_file(
+    url: str,
+    path: Optional[str] = None,
+    *,
+    connections: int = DEFAULT_CONNECTIONS,
+    part_size: int = DEFAULT_PART_SIZE,
+    sha256: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+    session: Optional[aiohttp.ClientSession] = None,
+) -> str:
+    """
+    Download a file from a URL without blocking the event loop, return the path of it.
+
+    path: where to save the file, a new file in temporary directory if None.
+        If a previous download to the same path was interrupted, it is resumed.
+    connections: number of concurrent range requests, the file is downloaded in one stream if server does not support ranges.
+    sha256: expected hex digest, ChecksumError is raised and the file is removed if it does not match.
+    progress: called with downloaded bytes and total bytes.
+    """
+    own_session = session is None
+    if session is None:
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60))
+
+    download = _Download(session, url, path, connections, part_size, progress)
+
+    # finished parts are kept, a retry only downloads the rest
+    @backoff.on_exception(backoff.expo, (aiohttp.ClientError, asyncio.TimeoutError), max_tries=3)
+    async def do_download() -> str:
+        return await download.run()
+
+    try:
+        path = await do_download()
+    finally:
+        if own_session:
+            await session.close()
+
+    if sha256 is not None:
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, _sha256_file, path)
+        if digest != sha256.lower():
+            _remove(path)
+            raise ChecksumError(f"sha256 of {url} is {digest}, expect {sha256}")
+    return path
+
+
+def run_sync(coro: Awaitable[Any]) -> Any:
     """
-    Download a file from a URL and save it to temporary directory.
+    Run coroutine to completion from sync code. If the current thread is running an event loop,
+    the coroutine runs in a new thread with its own loop, the current thread is blocked until it finishes.
     """
-    with requests.get(url, stream=True, timeout=5) as response:
-        response.raise_for_status()
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)  # type: ignore[arg-type]
+
+    result: Dict[str, Any] = {}
 
-        file_extension = ""
+    def target():
+        try:
+            result["value"] = asyncio.run(coro)  # type: ignore[arg-type]
+        except BaseException as e:
+            result["error"] = e
 
-        content_disposition = response.headers.get("Content-Disposition", "")
-        if content_disposition != "":
-            msg = message_from_string(f"Content-Disposition: {content_disposition}")
-            file_extension = os.path.splitext(msg.get("filename", ""))[1]
+    t = threading.Thread(target=target, daemon=True)
+    t.start()
+    t.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
 
-        if not file_extension:
-            file_extension = os.path.splitext(urlparse(url).path)[1]
 
-        with tempfile.NamedTemporaryFile(suffix=file_extension, delete=False) as temp_file:
-            for chunk in response.iter_content(1024 * 1024 * 10):
-                if chunk:
-                    temp_file.write(chunk)
-            return temp_file.name
+def download_file_from_url(url: str, **kwargs: Any) -> str:
+    """
+    Download a file from a URL and save it to temporary directory, or to EASE_DOWNLOAD_CACHE_DIR if it is set.
+    Blocking version of download_file, kwargs are passed to it. Use download_file in async handlers.
+    """
+    from .download_cache import default_download_cache
+
+    cache = default_download_cache()
+    if cache is not None and kwargs.get("path") is None:
+        kwargs.pop("path", None)
+        kwargs.pop("part_size", None)
+        kwargs.pop("session", None)
+        return cache.get_sync(url, **kwargs)
+    return run_sync(download_file(url, **kwargs))
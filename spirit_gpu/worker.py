@@ -1,21 +1,31 @@
 import asyncio
+from concurrent.futures import Executor
 from dataclasses import dataclass
-import dataclasses
 import inspect
-import json
+import signal
 import sys
-from typing import Dict, Any
+import time
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
 import aiohttp
 import backoff
 import base64
 
-from . import settings
+from . import codec, lifecycle, metrics, settings, startup
 from .manager import TaskManager
 from .env import Env
-from .task import MsgHeader, Operation, Status, Task
+from .task import MsgHeader, Operation, ResultData, Status, Task
+from .batch import new_batch_scheduler
+from .cache import fingerprint, handler_version, new_result_cache
 from .concurrency import Concurrency
+from .delivery import new_delivery_queue
+from .executor import ExecutorType, get_executor_type, get_max_workers, new_executor, uses_process_pool
+from .predict import PREDICTED_SHEDS, new_execution_predictor
+from .prefetch import PrefetchBuffer, new_prefetch_buffer
+from .process_pool import ProcessPool
 from .log import logger
 from .heartbeat import Heartbeat
+from .storage import new_result_store, result_size
+from .stream import ResultStream
 
 from .utils import current_unix_milli
 
@@ -36,9 +46,11 @@ class RequestStatus:
     totalDuration: int
     requestCreateAt: int
     message: str
+    cacheHit: bool = False
 
-    def json(self):
-        return json.dumps(dataclasses.asdict(self))
+    def json(self) -> bytes:
+        # fields are plain values, no need to deep copy by dataclasses.asdict
+        return codec.dumps(self.__dict__)
 
 
 class WorkConfig:
@@ -46,10 +58,35 @@ class WorkConfig:
         self.settings = settings.SETTINGS
 
         self.handlers = handlers
-        self.handler = await wrap_handler(handlers["handler"], env)
-        self.concurrency = Concurrency(handlers.get("concurrency_modifier", None))
+        concurrency_modifier = handlers.get("concurrency_modifier", None)
+        # shared by handler and stream handler, so max_workers bounds all of them
+        executor = new_executor(handlers)
+        self.batch_scheduler = new_batch_scheduler(handlers, env, executor)
+        if self.batch_scheduler is not None:
+            self.handler, max_concurrency = self.batch_scheduler.submit, None
+            if concurrency_modifier is None:
+                # fetch enough requests to fill a batch
+                max_batch_size = self.batch_scheduler.max_batch_size
+                concurrency_modifier = lambda _: max_batch_size
+        else:
+            self.handler, max_concurrency = await build_handler(handlers, env, executor)
+        self.stream_handler = await build_stream_handler(handlers, env, executor)
+        self.result_cache = new_result_cache(handlers)
+        self.handler_version = handler_version(handlers)
+        # fingerprint -> result of the running request, shared with identical requests arriving meanwhile
+        self.single_flight = bool(handlers.get("single_flight", False))
+        self.predictor = new_execution_predictor(handlers)
+        self.in_flight: Dict[str, asyncio.Future[Tuple[Optional[ResultData], Optional[str]]]] = {}
+        self.concurrency = Concurrency(concurrency_modifier, max_concurrency)
+        # e.g. AdaptiveConcurrency, told execution time and error of every request
+        self.observe: Optional[Callable[[float, bool], None]] = getattr(concurrency_modifier, "observe", None)
         self.env = env
         self.heartbeat = Heartbeat(self.concurrency)
+        self.delivery_queue = new_delivery_queue(self.concurrency)
+        self.prefetch = new_prefetch_buffer(self.concurrency)
+
+        self.result_store = new_result_store(self.settings.result_store())
+        self.large_result_threshold = self.settings.large_result_threshold()
 
         self.task_manager = TaskManager()
         await self.task_manager.init()
@@ -58,47 +95,208 @@ class WorkConfig:
 
 async def run(handlers: Dict[str, Any], env: Env):
     global WORKER
+    start = time.perf_counter()
     WORKER = WorkConfig()
+    # handler processes of executor "process" run setup and warmup during init
     await WORKER.init(handlers, env)
-    WORKER.heartbeat.start()
+    startup.mark("init")
+    in_process = not uses_process_pool(handlers)
+    await lifecycle.run_setup(handlers, env, in_process)
+    if in_process:
+        await lifecycle.run_warmup(handlers, env, warmup_handler)
+    lifecycle.freeze_gc(handlers)
+    startup.mark("setup and warmup")
+    elapsed = time.perf_counter() - start
+    lifecycle.WARMUP_SECONDS.set(elapsed)
+    logger.info(f"worker is ready to take tasks in {round(elapsed * 1000)}ms")
+
+    terminated = False
+    if "teardown" in handlers or logger.is_async():
+        # run teardown and flush queued log lines at exit on SIGTERM as well, by cancelling the loop below
+        task = asyncio.current_task()
+        assert task is not None
+
+        def terminate():
+            nonlocal terminated
+            terminated = True
+            task.cancel()
+
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, terminate)
+    try:
+        await run_loop()
+    except asyncio.CancelledError:
+        if not terminated:
+            raise
+        # SIGTERM is a normal shutdown, exit with code 0 after teardown
+        logger.info("worker is terminated by SIGTERM")
+    finally:
+        # handler processes of executor "process" run teardown when the pool closes at exit
+        await lifecycle.run_teardown(handlers, env, in_process)
+
+
+def report_startup():
+    if startup.reported():
+        return
+    startup.mark("first poll")
+    startup.report()
+    for phase, seconds in startup.timings():
+        metrics.STARTUP_SECONDS.labels(phase).set(seconds)
 
-    while True:
-        if WORKER.concurrency.is_available():
-            try:
-                task, health = await WORKER.task_manager.next()
-            except Exception as e:
-                logger.error(f"failed to get task: {e}", exc_info=True)
-                await asyncio.sleep(0.5)
-                continue
 
-            if len(WORKER.concurrency.current_jobs) == 0 and not health:
-                logger.error("agent is unhealthy, and no task is running, exit") 
-                sys.exit(1)
+async def warmup_handler(request: Any):
+    if WORKER.stream_handler is not None:
+        async for _ in WORKER.stream_handler(request):
+            pass
+        return
+    await WORKER.handler(request)
 
-            if task is None:
-                await asyncio.sleep(0.2)
-                continue
 
-            if task.header.request_id == "":
-                logger.error(f"request id of {task} is empty")
-                await asyncio.sleep(0.2)
-                continue
+async def run_loop():
+    metrics_port = WORKER.settings.metrics_port()
+    if metrics_port > 0:
+        metrics.SLOTS_OCCUPIED.set_function(lambda: len(WORKER.concurrency.current_jobs))
+        metrics.SLOTS_FREE.set_function(WORKER.concurrency.free_slots)
+        await metrics.start_server(metrics_port)
+    WORKER.heartbeat.start()
 
-            WORKER.concurrency.add_job(task.header.request_id)
-            asyncio.create_task(do_task(task))
+    interval = WORKER.settings.concurrency_interval_ms() / 1000
+    if WORKER.prefetch is not None:
+        await run_prefetch_loop(WORKER.prefetch, interval)
+        return
 
-        await asyncio.sleep(0.05)
+    while True:
+        # woken up as soon as a running request frees its slot
+        await WORKER.concurrency.wait_available(interval)
+        for task in await fetch_tasks(WORKER.concurrency.free_slots()):
+            dispatch(task)
+
+
+async def run_prefetch_loop(buffer: PrefetchBuffer, interval: float):
+    """
+    Fetch tasks into buffer in background, start them by earliest deadline whenever a slot is free.
+    """
+    fetcher = asyncio.create_task(prefetch_tasks(buffer, interval))
+    try:
+        while True:
+            await WORKER.concurrency.wait_available(interval)
+            await buffer.wait_not_empty()
+            drop_expired_prefetched(buffer)
+            task = buffer.pop()
+            if task is not None:
+                dispatch(task)
+    finally:
+        fetcher.cancel()
+
+
+async def prefetch_tasks(buffer: PrefetchBuffer, interval: float):
+    while True:
+        drop_expired_prefetched(buffer)
+        n = buffer.space()
+        if n == 0:
+            # buffer is full, look for expired tasks again after interval
+            await buffer.wait_taken(interval)
+            continue
+        buffer.push(await fetch_tasks(n))
+
+
+def drop_expired_prefetched(buffer: PrefetchBuffer):
+    for task in buffer.pop_expired(current_unix_milli()):
+        WORKER.concurrency.drop_prefetched(task.header.request_id)
+        asyncio.create_task(drop_prefetched(task))
+
+
+async def fetch_tasks(n: int) -> List[Task]:
+    """
+    Get up to n tasks from agent, exit if agent is unhealthy and no task is left.
+    Return nothing after a pause if there is no task, unless agent already held the request by long poll.
+    """
+    try:
+        start = time.perf_counter()
+        tasks, health = await WORKER.task_manager.next_batch(n)
+        metrics.FETCH_SECONDS.observe(time.perf_counter() - start)
+        report_startup()
+    except Exception as e:
+        logger.error(f"failed to get task: {e}", exc_info=True)
+        await asyncio.sleep(0.5)
+        return []
+
+    # running, prefetched, waiting for an identical request and delivering requests all need the worker
+    if len(WORKER.concurrency.get_jobs()) == 0 and not health:
+        logger.error("agent is unhealthy, and no task is running, exit")
+        sys.exit(1)
+
+    if len(tasks) == 0:
+        if not WORKER.task_manager.long_poll():
+            await asyncio.sleep(0.2)
+        return []
+
+    valid: List[Task] = []
+    for task in tasks:
+        if task.header.request_id == "":
+            logger.error(f"request id of {task} is empty")
+            continue
+        valid.append(task)
+    if len(valid) == 0:
+        await asyncio.sleep(0.2)
+    return valid
+
+
+def dispatch(task: Task):
+    WORKER.concurrency.add_job(task.header.request_id)
+    asyncio.create_task(do_task(task))
+
+
+async def drop_prefetched(task: Task):
+    """
+    Report expiry of a prefetched task and ack it. Body is not parsed, except to find webhook of async request.
+    """
+    header = task.header
+    webhook = header.webhook
+    try:
+        if header.mode == Operation.Async.value:
+            try:
+                webhook = str(codec.loads(task.data)["webhook"])
+            except Exception as e:
+                logger.error(f"failed to get webhook from request, err: {e}", request_id=header.request_id)
+        await drop_expired(header, current_unix_milli(), webhook)
+        await WORKER.task_manager.ack(header.request_id)
+    except Exception as e:
+        logger.error(f"failed to drop expired request, err: {e}", request_id=header.request_id, exc_info=True)
+    finally:
+        WORKER.concurrency.finish_delivery(header.request_id)
 
 
 async def do_task(task: Task):
+    request_id = task.header.request_id
+    deliver = None
     try:
-        await handle_task(task)
-        logger.info(f"finish handle request", request_id=task.header.request_id) 
+        deliver = await handle_task(task)
     except Exception as e:
-        logger.error(f"failed to handle request, err: {e}", request_id=task.header.request_id, exc_info=True)
+        logger.error(f"failed to handle request, err: {e}", request_id=request_id, exc_info=True)
+
+    async def finish():
+        if deliver is not None:
+            try:
+                await deliver()
+            except Exception as e:
+                logger.error(f"failed to deliver request, err: {e}", request_id=request_id, exc_info=True)
+        logger.info(f"finish handle request", request_id=request_id) 
+        await WORKER.task_manager.ack(request_id)
+
+    if not WORKER.concurrency.holds_slot(request_id):
+        # waited for an identical request, its slot is already freed
+        await finish()
+        WORKER.concurrency.finish_delivery(request_id)
+        return
+
+    if deliver is None or WORKER.delivery_queue is None:
+        await finish()
+        WORKER.concurrency.remove_job(request_id)
+        return
 
-    await WORKER.task_manager.ack(task.header.request_id)
-    WORKER.concurrency.remove_job(task.header.request_id)
+    # free the slot for next request, heartbeat keeps the request alive until it is acked
+    await WORKER.delivery_queue.put(request_id, finish)
+    WORKER.concurrency.start_delivery(request_id)
 
 
 async def report_exec(
@@ -115,7 +313,7 @@ async def report_exec(
         0,
         "start executing",
     )
-    await WORKER.task_manager.report_status(header.request_id, status.json().encode())
+    await WORKER.task_manager.report_status(header.request_id, status.json())
 
 
 async def parse_data(
@@ -125,7 +323,7 @@ async def parse_data(
 ) -> tuple[Any, str, bool]:
     webhook = header.webhook
     try:
-        request = json.loads(data)
+        request = codec.loads(data)
         _ = request["input"]
         if header.mode == Operation.Async.value:
             webhook = str(request["webhook"])
@@ -148,13 +346,68 @@ async def parse_data(
             error,
         )
         await WORKER.task_manager.report_status(
-            header.request_id, status.json().encode()
+            header.request_id, status.json()
         )
         return None, "", False
     return request, webhook, True
 
 
-async def wrap_handler(handler: Any, env: Env):
+async def build_handler(handlers: Dict[str, Any], env: Env, executor: Optional[Executor]) -> Tuple[Any, Optional[int]]:
+    """
+    Wrap handlers["handler"] with the executor selected by handlers["executor"], executor is created by new_executor.
+    Return the wrapped handler and max concurrency allowed by the executor.
+    """
+    if uses_process_pool(handlers):
+        pool = ProcessPool(
+            handlers["handler"],
+            env.config,
+            get_max_workers(handlers),
+            handlers.get("setup"),
+            handlers.get("warmup"),
+            handlers.get("teardown"),
+        )
+        pool.start()
+        return pool.submit, pool.size()
+
+    handler = handlers["handler"]
+    wrapped = await wrap_handler(handler, env, executor)
+    if executor is None or inspect.iscoroutinefunction(handler) or inspect.isasyncgenfunction(handler):
+        # async handlers run in event loop, not limited by the pool
+        return wrapped, None
+    # jobs more than pool size would only wait for a free thread
+    return wrapped, get_max_workers(handlers)
+
+
+async def build_stream_handler(handlers: Dict[str, Any], env: Env, executor: Optional[Executor]) -> Optional[Any]:
+    """
+    Return handler yielding results incrementally if handlers["stream"] is set, otherwise None.
+    """
+    if not handlers.get("stream", False):
+        return None
+
+    handler = handlers.get("handler")
+    if not (inspect.isasyncgenfunction(handler) or inspect.isgeneratorfunction(handler)):
+        logger.warn("stream is only supported by generator handlers, ignore it")
+        return None
+    if get_executor_type(handlers) == ExecutorType.Process:
+        logger.warn(f"stream is not supported by executor {ExecutorType.Process.value}, ignore it")
+        return None
+    return await wrap_stream_handler(handler, env, executor)
+
+
+def _next_item(gen: Any) -> Tuple[bool, Any]:
+    # StopIteration cannot be raised through a future, return a flag instead
+    try:
+        return False, next(gen)
+    except StopIteration:
+        return True, None
+
+
+async def wrap_handler(handler: Any, env: Env, executor: Optional[Executor] = None):
+    """
+    Wrap user handler to a coroutine function.
+    If executor is given, sync handlers and each step of sync generators run in it instead of event loop.
+    """
     if inspect.isasyncgenfunction(handler):
 
         async def async_gen_handler(request: Any):
@@ -176,104 +429,378 @@ async def wrap_handler(handler: Any, env: Env):
 
         async def generator_handler(request: Any):
             res: Any = []
-            for r in handler(request, env):
+            if executor is None:
+                for r in handler(request, env):
+                    res.append(r)
+                return res
+
+            loop = asyncio.get_running_loop()
+            gen = handler(request, env)
+            while True:
+                done, r = await loop.run_in_executor(executor, _next_item, gen)
+                if done:
+                    return res
                 res.append(r)
-            return res
 
         return generator_handler
 
     else:
 
         async def normal_handler(request: Any):
-            return handler(request, env)
+            if executor is None:
+                return handler(request, env)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, handler, request, env)
 
         return normal_handler
 
 
+async def wrap_stream_handler(handler: Any, env: Env, executor: Optional[Executor] = None):
+    """
+    Wrap generator handler to an async generator function, yielding items as soon as handler yields them.
+    """
+    if inspect.isasyncgenfunction(handler):
+
+        async def async_gen_stream_handler(request: Any):
+            async for r in handler(request, env):
+                yield r
+
+        return async_gen_stream_handler
+
+    async def generator_stream_handler(request: Any):
+        gen = handler(request, env)
+        if executor is None:
+            for r in gen:
+                yield r
+            return
+
+        loop = asyncio.get_running_loop()
+        while True:
+            done, r = await loop.run_in_executor(executor, _next_item, gen)
+            if done:
+                return
+            yield r
+
+    return generator_stream_handler
+
+
 async def check_wait_time(header: MsgHeader, execStartTs: int, webhook: str) -> bool:
     if execStartTs - header.enqueue_at > header.ttl:
-        error = f"request enqueue time exceed ttl {header.ttl} milliseconds, drop it to reduce worker running time"
-        logger.error(error, request_id=header.request_id) 
-        status = getStatus(
-            header,
-            current_unix_milli(),
-            "",
-            Status.Failed.value,
-            execStartTs - header.enqueue_at,
-            0,
-            0,
-            error,
-        )
-        await WORKER.task_manager.report_status(
-            header.request_id, status.json().encode()
-        )
-        await send_request(
-            header=header,
-            webhook=webhook,
-            status_code=408,
-            message=error,
-            data=json.dumps({"error": error}).encode(),
-        )        
+        await drop_expired(header, execStartTs, webhook)
         return False
     return True
 
 
+async def drop_expired(header: MsgHeader, waitFinishTs: int, webhook: str):
+    metrics.TTL_DROPS.inc()
+    error = f"request enqueue time exceed ttl {header.ttl} milliseconds, drop it to reduce worker running time"
+    await reject(header, waitFinishTs, webhook, error)
+
+
+async def check_predicted_time(header: MsgHeader, webhook: str, bucket: str, predicted: float) -> bool:
+    """
+    Reject request if it is predicted to exceed ttl before its handler finishes.
+    """
+    now = current_unix_milli()
+    left = header.enqueue_at + header.ttl - now
+    if predicted * 1000 <= left:
+        return True
+    assert WORKER.predictor is not None
+    if WORKER.predictor.probe(bucket):
+        logger.info(
+            f"predicted execution time {round(predicted * 1000)} milliseconds exceeds {max(0, left)} milliseconds left "
+            f"of ttl, run it to refresh the prediction",
+            request_id=header.request_id,
+        )
+        return True
+    PREDICTED_SHEDS.inc()
+    error = (
+        f"predicted execution time {round(predicted * 1000)} milliseconds exceeds {max(0, left)} milliseconds left "
+        f"of ttl {header.ttl} milliseconds, reject it before running handler"
+    )
+    await reject(header, now, webhook, error)
+    return False
+
+
+async def reject(header: MsgHeader, waitFinishTs: int, webhook: str, error: str):
+    """
+    Fail request without running handler, with status code 408.
+    """
+    logger.error(error, request_id=header.request_id) 
+    status = getStatus(
+        header,
+        current_unix_milli(),
+        "",
+        Status.Failed.value,
+        waitFinishTs - header.enqueue_at,
+        0,
+        0,
+        error,
+    )
+    await WORKER.task_manager.report_status(
+        header.request_id, status.json()
+    )
+    await send_request(
+        header=header,
+        webhook=webhook,
+        status_code=408,
+        message=error,
+        data=codec.dumps({"error": error}),
+    )        
+
+
 async def handle_task(
     task: Task,
-):
+) -> Optional[Callable[[], Awaitable[None]]]:
+    """
+    Run handler of the task, return the function delivering its result or error, None if nothing left to deliver.
+    """
     header = task.header
     logger.info(f"handle request", request_id=task.header.request_id)
 
     execStartTs = max(current_unix_milli(), header.enqueue_at)
+    start = time.perf_counter()
     request, webhook, ok = await parse_data(header, execStartTs, task.data)
+    metrics.PARSE_SECONDS.observe(time.perf_counter() - start)
     if not ok:
-        return
+        return None
 
     ok = await check_wait_time(header, execStartTs, webhook)
     if not ok:
-        return
+        return None
+
+    metrics.QUEUE_WAIT_SECONDS.observe((execStartTs - header.enqueue_at) / 1000)
+
+    if WORKER.stream_handler is not None:
+        await report_exec(header, execStartTs)
+        # stream is delivered while handler is running
+        await handle_stream(header, request, webhook, execStartTs)
+        return None
+
+    key = None
+    if WORKER.result_cache is not None or WORKER.single_flight:
+        key = fingerprint(request["input"], WORKER.handler_version)
+
+    cached = None
+    if WORKER.result_cache is not None:
+        cached = await WORKER.result_cache.get(key)
+
+    bucket, predicted = "", None
+    if WORKER.predictor is not None:
+        bucket = WORKER.predictor.bucket(request)
+        predicted = WORKER.predictor.predict(bucket)
+        # cached and identical running requests do not run handler, they are not rejected
+        joins = WORKER.single_flight and key in WORKER.in_flight
+        if cached is None and not joins and predicted is not None:
+            # rejected before reporting executing
+            if not await check_predicted_time(header, webhook, bucket, predicted):
+                return None
 
     await report_exec(header, execStartTs)
 
+    if cached is not None:
+        logger.info("result cache hit", request_id=header.request_id)
+        execFinishTs = current_unix_milli()
+        return lambda: deliver_result(header, webhook, execStartTs, execFinishTs, cached, cache_hit=True)
+
+    if WORKER.single_flight and key in WORKER.in_flight:
+        return await wait_in_flight(header, webhook, execStartTs, WORKER.in_flight[key])
+
+    flight = None
+    if WORKER.single_flight:
+        flight = asyncio.get_running_loop().create_future()
+        WORKER.in_flight[key] = flight
+
+    start = time.perf_counter()
+    try:
+        deliver, result = await run_handler(header, request, webhook, execStartTs, key)
+    except BaseException as e:
+        if flight is not None:
+            flight.set_result((None, f"identical request failed: {e}"))
+        raise
+    finally:
+        if flight is not None:
+            del WORKER.in_flight[key]
+    if flight is not None:
+        flight.set_result(result)
+    if WORKER.predictor is not None and result[1] is None:
+        # failed requests may fail fast, only successful ones tell how long handler takes
+        WORKER.predictor.observe(bucket, time.perf_counter() - start, predicted)
+    return deliver
+
+
+async def wait_in_flight(
+    header: MsgHeader,
+    webhook: str,
+    execStartTs: int,
+    flight: "asyncio.Future[Tuple[Optional[ResultData], Optional[str]]]",
+) -> Optional[Callable[[], Awaitable[None]]]:
+    """
+    Wait for the result of an identical running request without holding a slot, at most until ttl of this request.
+    """
+    request_id = header.request_id
+    logger.info("identical request is running, wait for its result", request_id=request_id)
+    WORKER.concurrency.park(request_id)
+    try:
+        timeout = max(0, header.enqueue_at + header.ttl - current_unix_milli()) / 1000
+        try:
+            res, error = await asyncio.wait_for(asyncio.shield(flight), timeout)
+        except asyncio.TimeoutError:
+            await drop_expired(header, current_unix_milli(), webhook)
+            return None
+    finally:
+        WORKER.concurrency.unpark(request_id)
+
+    metrics.SINGLE_FLIGHT_WAITS.inc()
+    execFinishTs = current_unix_milli()
+    if error is not None:
+        return lambda: deliver_error(header, webhook, execStartTs, error)
+    return lambda: deliver_result(header, webhook, execStartTs, execFinishTs, res)
+
+
+async def run_handler(
+    header: MsgHeader, request: Any, webhook: str, execStartTs: int, cache_key: Optional[str]
+) -> Tuple[Callable[[], Awaitable[None]], Tuple[Optional[ResultData], Optional[str]]]:
+    """
+    Return the function delivering result or error, and the result or error itself.
+    """
     # handle
+    start = time.perf_counter()
     try:
-        res = await WORKER.handler(request)
-        if not isinstance(res, bytes):
-            res = json.dumps(res).encode()
+        if WORKER.batch_scheduler is not None:
+            res = await WORKER.batch_scheduler.submit(request, header.enqueue_at + header.ttl)
+        else:
+            res = await WORKER.handler(request)
+        if not isinstance(res, (bytes, bytearray, memoryview)):
+            res = codec.dumps(res)
 
     except Exception as e:
+        observe_handler(time.perf_counter() - start, True)
+        metrics.HANDLER_ERRORS.inc()
         error = f"custom handler raise exception during running, err: {e}"
         logger.error(error, request_id=header.request_id, exc_info=True) 
+        return lambda: deliver_error(header, webhook, execStartTs, error), (None, error)
+
+    observe_handler(time.perf_counter() - start, False)
+    execFinishTs = current_unix_milli()
+    if WORKER.result_cache is not None and cache_key is not None:
+        await WORKER.result_cache.put(cache_key, res)
+    return lambda: deliver_result(header, webhook, execStartTs, execFinishTs, res), (res, None)
+
+
+def observe_handler(seconds: float, error: bool):
+    metrics.HANDLER_SECONDS.observe(seconds)
+    if WORKER.observe is not None:
+        try:
+            WORKER.observe(seconds, error)
+        except Exception as e:
+            logger.error(f"failed to call observe of concurrency_modifier, err: {e}", exc_info=True)
+
+
+async def deliver_error(header: MsgHeader, webhook: str, execStartTs: int, error: str):
+    status = getStatus(
+        header,
+        current_unix_milli(),
+        webhook,
+        Status.Failed.value,
+        execStartTs - header.enqueue_at,
+        0,
+        0,
+        error,
+    )
+    await WORKER.task_manager.report_status(
+        header.request_id, status.json()
+    )
+    await send_request(
+        header=header,
+        webhook=webhook,
+        status_code=500,
+        message=error,
+        data=codec.dumps({"error": error}),
+    )
+
+
+async def deliver_result(
+    header: MsgHeader, webhook: str, execStartTs: int, execFinishTs: int, res: ResultData, cache_hit: bool = False
+):
+    err = await send_request(
+        header=header, webhook=webhook, status_code=200, message="", data=res
+    )
+    if err is not None:
+        error = f"failed to send result to user, err: {err}"
+        logger.error(error, request_id=header.request_id) 
+
         status = getStatus(
             header,
             current_unix_milli(),
             webhook,
             Status.Failed.value,
             execStartTs - header.enqueue_at,
-            0,
-            0,
+            execFinishTs - execStartTs,
+            execFinishTs - header.enqueue_at,
             error,
         )
         await WORKER.task_manager.report_status(
-            header.request_id, status.json().encode()
+            header.request_id, status.json()
         )
-        await send_request(
-            header=header,
-            webhook=webhook,
-            status_code=500,
-            message=error,
-            data=json.dumps({"error": error}).encode(),
+        return
+
+    status = getStatus(
+        header,
+        current_unix_milli(),
+        webhook,
+        Status.Succeed.value,
+        execStartTs - header.enqueue_at,
+        execFinishTs - execStartTs,
+        execFinishTs - header.enqueue_at,
+        "succeed",
+        cache_hit,
+    )
+    await WORKER.task_manager.report_status(header.request_id, status.json())
+
+
+async def handle_stream(header: MsgHeader, request: Any, webhook: str, execStartTs: int):
+    stream = ResultStream(WORKER.session, WORKER.task_manager, header, webhook)
+    start = time.perf_counter()
+    try:
+        async for item in WORKER.stream_handler(request):
+            await stream.send(item)
+    except Exception as e:
+        observe_handler(time.perf_counter() - start, True)
+        metrics.HANDLER_ERRORS.inc()
+        error = f"custom handler raise exception during running, err: {e}"
+        logger.error(error, request_id=header.request_id, exc_info=True)
+        err = await stream.fail(error)
+        if err is None and stream.collected() is not None:
+            err = await send_request(
+                header=header, webhook="", status_code=500, message=error, data=codec.dumps({"error": error})
+            )
+        if err is not None:
+            error = f"{error}, {err}"
+        status = getStatus(
+            header,
+            current_unix_milli(),
+            webhook,
+            Status.Failed.value,
+            execStartTs - header.enqueue_at,
+            0,
+            0,
+            error,
         )
+        await WORKER.task_manager.report_status(header.request_id, status.json())
         return
 
+    # chunks are sent while handler is running, so this includes delivery of all but the last ones
+    observe_handler(time.perf_counter() - start, False)
+    err = await stream.finish()
+    collected = stream.collected()
+    if err is None and collected is not None:
+        # agent does not support result chunks, send what handler yielded as one json array, as without stream
+        err = await send_request(header=header, webhook="", status_code=200, message="", data=codec.dumps(collected))
     execFinishTs = current_unix_milli()
-    err = await send_request(
-        header=header, webhook=webhook, status_code=200, message="", data=res
-    )
     if err is not None:
-        error = f"failed to send result to user, err: {err}"
-        logger.error(error, request_id=header.request_id) 
-
+        error = f"failed to stream result to user, err: {err}"
+        logger.error(error, request_id=header.request_id)
         status = getStatus(
             header,
             current_unix_milli(),
@@ -284,9 +811,7 @@ async def handle_task(
             execFinishTs - header.enqueue_at,
             error,
         )
-        await WORKER.task_manager.report_status(
-            header.request_id, status.json().encode()
-        )
+        await WORKER.task_manager.report_status(header.request_id, status.json())
         return
 
     status = getStatus(
@@ -299,7 +824,7 @@ async def handle_task(
         execFinishTs - header.enqueue_at,
         "succeed",
     )
-    await WORKER.task_manager.report_status(header.request_id, status.json().encode())
+    await WORKER.task_manager.report_status(header.request_id, status.json())
 
 
 async def send_request(
@@ -308,13 +833,14 @@ async def send_request(
     webhook: str,
     status_code: int,
     message: str,
-    data: bytes,
+    data: ResultData,
 ):
 
     @backoff.on_exception(
         backoff.expo,
         aiohttp.ClientError,
         max_tries=3,
+        on_backoff=lambda _: metrics.WEBHOOK_RETRIES.inc(),
     )
     async def do_send():
         async with WORKER.session.post(
@@ -328,22 +854,32 @@ async def send_request(
 
     resp, text, err = None, None, None
 
+    data = await offload_result(header, data)
+
     if webhook != "":
+        start = time.perf_counter()
         try:
             resp, text = await do_send()
         except Exception as e:
             err = f"failed to call webhook <{webhook}>: {str(e)}"
+        metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - start)
         if resp is not None:
             if resp.status != 200:
                 err = f"request {header.request_id} receive unsuccess status code {resp.status} from webhook, body: {text}"
 
+    start = time.perf_counter()
     try:
-        result = getResult(status_code, message, data)
-        json_result = json.dumps(result).encode()
-        await WORKER.task_manager.send_result(
-            header.request_id,
-            json_result,
-        )
+        sent = False
+        if WORKER.task_manager.binary_result():
+            sent = await WORKER.task_manager.send_binary_result(header.request_id, status_code, message, data)
+        if not sent:
+            result = getResult(status_code, message, data)
+            json_result = codec.dumps(result)
+            await WORKER.task_manager.send_result(
+                header.request_id,
+                json_result,
+            )
+        metrics.AGENT_UPLOAD_SECONDS.observe(time.perf_counter() - start)
     except Exception as e:
         if err is not None:
             err = f"{err}, failed to send result to agent: {e}"
@@ -354,7 +890,23 @@ async def send_request(
     return err
 
 
-def getResult(status_code: int, message: str, data: bytes) -> Dict[str, Any]:
+async def offload_result(header: MsgHeader, data: ResultData) -> ResultData:
+    """
+    Put result larger than threshold to result store, return a reference to it instead.
+    Return data itself if there is no store, the result is small or failed to store it.
+    """
+    if WORKER.result_store is None or result_size(data) <= WORKER.large_result_threshold:
+        return data
+    try:
+        ref = await WORKER.result_store.put(data)
+    except Exception as e:
+        logger.error(f"failed to store large result, send it inline, err: {e}", request_id=header.request_id, exc_info=True)
+        return data
+    logger.info(f"large result is stored to {ref['url']}", request_id=header.request_id)
+    return codec.dumps({"resultRef": ref})
+
+
+def getResult(status_code: int, message: str, data: ResultData) -> Dict[str, Any]:
     return {
         "statusCode": status_code,
         "message": message,
@@ -371,6 +923,7 @@ def getStatus(
     execDur: int,
     totalDur: int,
     msg: str,
+    cacheHit: bool = False,
 ):
     return RequestStatus(
         timestamp=ts,
@@ -384,4 +937,5 @@ def getStatus(
         totalDuration=totalDur,
         requestCreateAt=header.create_at,
         message=msg,
+        cacheHit=cacheHit,
     )
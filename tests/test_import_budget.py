@@ -0,0 +1,19 @@
+import pytest
+
+from spirit_gpu.bench.imports import DEFAULT_FORBIDDEN, measure
+
+# generous compared to the 100ms of the benchmark default, shared CI runners are slow and noisy
+BUDGET_MS = 500
+
+
+@pytest.fixture(scope="module")
+def result():
+    return measure("spirit_gpu", 3, DEFAULT_FORBIDDEN)
+
+
+def test_import_within_budget(result):
+    assert result["medianMs"] <= BUDGET_MS, f"import spirit_gpu is too slow, slowest imports: {result['slowestMs']}"
+
+
+def test_import_loads_no_runtime_dependencies(result):
+    assert result["forbiddenLoaded"] == []
@@ -0,0 +1,51 @@
+import asyncio
+import json
+from typing import List
+
+from spirit_gpu import settings, worker
+from spirit_gpu.bench.agent import FakeAgent
+from spirit_gpu.conf import Config
+from spirit_gpu.env import Env
+
+
+def test_batch_handler_with_process_executor_runs_hooks(monkeypatch):
+    # batch_handler runs in worker process whatever the executor is, so do its hooks
+    monkeypatch.setattr(settings.SETTINGS, "_agent_url", "")
+    calls: List[str] = []
+
+    def setup(env):
+        calls.append("setup")
+
+    def teardown(env):
+        calls.append("teardown")
+
+    async def batch_handler(requests, env):
+        if "setup" not in calls:
+            raise Exception("setup never ran")
+        return [request["input"] for request in requests]
+
+    handlers = {
+        "batch_handler": batch_handler,
+        "executor": "process",
+        "setup": setup,
+        "warmup": [{"input": 0}],
+        "teardown": teardown,
+    }
+    agent = FakeAgent(long_poll=False, batch_report=False, binary_result=False)
+
+    async def main():
+        await agent.start()
+        settings.SETTINGS._agent_url = agent.url
+        request_id = agent.submit({"input": 1})
+        task = asyncio.create_task(worker.run(handlers, Env(Config())))
+        try:
+            await agent.wait_acked(1, 10)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await agent.stop()
+        return json.loads(agent.results[request_id])
+
+    result = asyncio.run(main())
+    assert result["statusCode"] == 200
+    assert calls == ["setup", "teardown"]
@@ -0,0 +1,58 @@
+import asyncio
+from typing import List
+
+import pytest
+from aiohttp import web
+
+from spirit_gpu import settings, worker
+from spirit_gpu.bench.agent import FakeAgent
+from spirit_gpu.conf import Config
+from spirit_gpu.env import Env
+from spirit_gpu.task import Operation
+
+
+async def handler(request, env):
+    return {"output": request["input"]}
+
+
+def test_unhealthy_agent_waits_for_delivering_requests(monkeypatch):
+    # results are delivered after the slot is freed
+    monkeypatch.setenv(settings.EASE_DELIVERY_CONCURRENCY, "2")
+    monkeypatch.setattr(settings.SETTINGS, "_agent_url", "")
+    received: List[bytes] = []
+    agent = FakeAgent(long_poll=False)
+
+    async def webhook(request: web.Request):
+        await asyncio.sleep(3)
+        received.append(await request.read())
+        return web.Response()
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/webhook", webhook)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+
+        await agent.start()
+        settings.SETTINGS._agent_url = agent.url
+        request_id = agent.submit({"input": 1, "webhook": f"http://{host}:{port}/webhook"}, mode=Operation.Async.value)
+        task = asyncio.create_task(worker.run({"handler": handler}, Env(Config())))
+        try:
+            while request_id not in agent.stats.picked:
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(0.5)
+            agent.healthy = False
+            # worker exits after the request is delivered and acked
+            await task
+        finally:
+            task.cancel()
+            await agent.stop()
+            await runner.cleanup()
+
+    with pytest.raises(SystemExit):
+        asyncio.run(main())
+    assert len(agent.stats.acked) == 1
+    assert len(received) == 1